@@ -1,85 +1,419 @@
+import asyncio
 import json
-from fastapi import APIRouter, HTTPException
+import secrets
+import time
+from typing import AsyncIterator, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from fastapi.responses import StreamingResponse
 
 from app.core.config import Config
+from app.core.metrics import (
+    ANSWERS,
+    PROMPT_TOKENS,
+    RETRIEVAL_HITS,
+    RETRIEVALS,
+    StageTimer,
+    process_memory,
+)
 from app.core.templates import TemplateManager
-from app.models.faiss_index import FAISSIndex
-from app.models.schemas import ChatRequest, ChatResponse
-from app.models.llm import LLM
-from app.models.ocr import OCR
+from app.models.bm25 import reciprocal_rank_fusion
+from app.models.cache import EmbeddingCache, SemanticCache
+from app.models.faiss_index import FAISSIndex, SearchBatcher
+from app.models.schemas import ChatRequest, ChatResponse, SearchParams
+from app.models.llm import LLM, AnswerStreamParser
+from app.models.ocr import (
+    OCR,
+    OCRBusyError,
+    OCRImageTooLargeError,
+    OCRTimeoutError,
+    Preprocessing,
+)
 
 router = APIRouter(redirect_slashes=False)
 
-ocr = OCR()
-tm = TemplateManager()
-llm = LLM(
-    api_key=Config.OPENAI_API_KEY,
-    base_url=Config.OPENAI_BASE_URL,
-)
-faiss = FAISSIndex(
-    index_path=Config.FAISS_INDEX_PATH,
-    meta_path=Config.METADATA_PATH,
-    embed_dim=Config.EMBED_DIM,
-    similarity_threshold=Config.SIMILARITY_THRESHOLD,
-)
+# Built by init_resources() from the app's lifespan handler, so importing this
+# module stays cheap and nothing touches the index before the server starts
+ocr: OCR
+tm: TemplateManager
+llm: LLM
+faiss: FAISSIndex
+searcher: SearchBatcher
+semantic_cache: SemanticCache
 
 
-@router.post("", response_model=ChatResponse)
-async def chat(request: ChatRequest):
-    extra_relevant = None
+def init_resources():
+    global ocr, tm, llm, faiss, searcher, semantic_cache
+    ocr = OCR(
+        max_workers=Config.OCR_WORKERS,
+        max_pending=Config.OCR_MAX_PENDING,
+        timeout=Config.OCR_TIMEOUT,
+        max_bytes=Config.OCR_MAX_IMAGE_BYTES,
+        preprocessing=Preprocessing(
+            max_pixels=Config.OCR_MAX_PIXELS,
+            max_width=Config.OCR_MAX_WIDTH,
+            target_dpi=Config.OCR_TARGET_DPI,
+            binarize=Config.OCR_BINARIZE,
+            tile_height=Config.OCR_TILE_HEIGHT,
+        ),
+    )
+    tm = TemplateManager(max_prompt_tokens=Config.PROMPT_TOKEN_BUDGET)
+    # Load the tokenizer now: tiktoken may have to download it, and a missing
+    # encoding should stop startup rather than fail every chat request
+    tm.encoding
+    llm = LLM(
+        api_key=Config.OPENAI_API_KEY,
+        base_url=Config.OPENAI_BASE_URL,
+        embed_cache=EmbeddingCache(
+            max_entries=Config.EMBED_CACHE_SIZE,
+            path=Config.EMBED_CACHE_PATH or None,
+        ),
+    )
+    faiss = FAISSIndex(
+        index_path=Config.FAISS_INDEX_PATH,
+        meta_path=Config.METADATA_PATH,
+        embed_dim=Config.EMBED_DIM,
+        similarity_threshold=Config.SIMILARITY_THRESHOLD,
+        chunk_store_path=Config.CHUNK_STORE_PATH,
+        index_type=Config.FAISS_INDEX_TYPE,
+        index_params=Config.FAISS_INDEX_PARAMS,
+        nprobe=Config.FAISS_NPROBE,
+        ef_search=Config.FAISS_EF_SEARCH,
+        bm25_path=Config.BM25_INDEX_PATH,
+        vectors_path=Config.VECTORS_PATH,
+        rescore_factor=Config.FAISS_RESCORE_FACTOR,
+        mmap=Config.FAISS_MMAP,
+        parents_path=Config.PARENT_STORE_PATH,
+        expand_ratio=Config.PARENT_EXPAND_RATIO,
+        build_marker_path=Config.BUILD_MARKER_PATH,
+    )
+    searcher = SearchBatcher(
+        faiss,
+        max_batch_size=Config.FAISS_BATCH_SIZE,
+        max_wait_ms=Config.FAISS_BATCH_WAIT_MS,
+    )
+    semantic_cache = SemanticCache(
+        embed_dim=Config.EMBED_DIM,
+        similarity_threshold=Config.SEMANTIC_CACHE_THRESHOLD,
+        ttl=Config.SEMANTIC_CACHE_TTL,
+        max_entries=Config.SEMANTIC_CACHE_SIZE,
+    )
+
+
+async def warmup():
+    """Fault in the index files and open an API connection before serving."""
+    await asyncio.to_thread(faiss.warmup)
+    await llm.warmup()
 
+
+async def close_resources():
+    ocr.shutdown()
+    if llm.embed_cache is not None:
+        llm.embed_cache.close()
+    await llm.client.close()
+
+
+NO_CONTEXT_ANSWER = "I'm sorry, I don't have enough context to answer that question."
+
+
+async def prepare_chat(
+    request: ChatRequest, timer: StageTimer
+) -> Tuple[Optional[np.ndarray], Hashable, Optional[ChatResponse], Optional[str]]:
+    """Run OCR, embedding and retrieval shared by the JSON and streaming routes.
+
+    Returns the query embedding (``None`` when retrieval was answered by BM25
+    alone), the version of the index snapshot it searched, plus either a ready
+    answer (cache hit or no relevant context) or the prompt to send to the
+    LLM. Each step is timed on ``timer``.
+    """
     # 1. Extract text and if there’s a Base64 image, decode + OCR
     if request.image:
         try:
-            ocr_text = ocr.extract_text(request.image)
-            query_embedding = await llm.embed(request.question)
-            extra_relevant = faiss.search(query_embedding, k=15)
-
+            # The Base64 text goes to the pool as is: the size limit is checked
+            # on its length and decoding never runs on the event loop
+            with timer.stage("ocr"):
+                ocr_text = await ocr.extract_text_async(request.image)
             augmented_query = f"{request.question}\n\nOCR result:\n{ocr_text}"
+        except OCRBusyError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        except OCRTimeoutError as e:
+            raise HTTPException(status_code=504, detail=str(e))
+        except OCRImageTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
         except Exception as e:
-            raise HTTPException(status_code=400, detail=f"OCR decoding error: {e}")
+            # OCR already words its errors as "OCR decoding error: ..."
+            raise HTTPException(status_code=400, detail=str(e))
     else:
         augmented_query = request.question
 
     if not augmented_query:
         raise HTTPException(status_code=400, detail="Query cannot be empty.")
 
-    # 2. Embed the augmented query
-    query_embedding = await llm.embed(augmented_query)
+    # Pin the index snapshot so a hot reload can't mix up ids and metadata
+    snapshot = faiss.snapshot
 
-    # 3. Search FAISS
-    relevant = faiss.search(query_embedding, k=15)
-    if extra_relevant:
-        relevant.extend(extra_relevant)
+    # 2. Keyword search first: a decisive BM25 match needs no embeddings call
+    lexical = snapshot.lexical if Config.RETRIEVAL_MODE != "dense" else None
+    lexical_hits = []
+    if lexical is not None:
+        with timer.stage("lexical"):
+            lexical_hits = lexical.search(augmented_query, k=15)
+    if lexical is not None and (
+        Config.RETRIEVAL_MODE == "lexical"
+        or lexical.is_decisive(
+            augmented_query,
+            lexical_hits,
+            min_coverage=Config.LEXICAL_MIN_COVERAGE,
+            min_margin=Config.LEXICAL_MIN_MARGIN,
+        )
+    ):
+        RETRIEVALS.inc(mode="lexical")
+        query_embedding = None
+        relevant = lexical_hits
+    else:
+        # 3. Embed the augmented query (and the bare question when an image
+        #    was attached) in a single request
+        texts = (
+            [augmented_query, request.question] if request.image else [augmented_query]
+        )
+        with timer.stage("embed"):
+            query_embeddings = await llm.embed_many(texts)
+        query_embedding = query_embeddings[0]
+
+        # Close paraphrases of an already answered question skip retrieval and the LLM
+        with timer.stage("cache"):
+            semantic_cache.bind(snapshot.version)
+            cached = semantic_cache.get(query_embedding)
+        if cached is not None:
+            ANSWERS.inc(source="cache")
+            return query_embedding, snapshot.version, cached, None
 
+        # 4. Search FAISS with every query vector at once, batched with other requests
+        with timer.stage("search"):
+            relevant = await searcher.search_many(
+                query_embeddings, k=15, snapshot=snapshot
+            )
+        if lexical is not None:
+            RETRIEVALS.inc(mode="hybrid")
+            relevant = reciprocal_rank_fusion([relevant, lexical_hits], k=Config.RRF_K)[
+                :15
+            ]
+        else:
+            RETRIEVALS.inc(mode="dense")
+
+    RETRIEVAL_HITS.observe(len(relevant))
     if not relevant:
-        return ChatResponse(
-            answer="I'm sorry, I don't have enough context to answer that question.",
-            links=[],
+        ANSWERS.inc(source="no_context")
+        return (
+            query_embedding,
+            snapshot.version,
+            ChatResponse(answer=NO_CONTEXT_ANSWER, links=[]),
+            None,
         )
 
-    # 4. Collect excerpts and metadata
-    excerpts = faiss.generate_excerpts(relevant)
+    # 5. Collect excerpts and metadata
+    with timer.stage("excerpts"):
+        excerpts = faiss.generate_excerpts(relevant, snapshot=snapshot)
+
+    # 6. Build prompt for OpenAI, filling the token budget in score order
+    with timer.stage("prompt"):
+        prompt, prompt_tokens = tm.build_prompt_with_usage(excerpts, augmented_query)
+    PROMPT_TOKENS.observe(prompt_tokens)
+    return query_embedding, snapshot.version, None, prompt
+
 
-    # 5. Build prompt for OpenAI
-    prompt = tm.build_prompt(excerpts, augmented_query)
+def timed_error(e: HTTPException, timer: StageTimer) -> HTTPException:
+    """Attach ``Server-Timing`` to an error, whose response FastAPI builds anew."""
+    e.headers = {**(e.headers or {}), "Server-Timing": timer.header()}
+    return e
 
-    # 6. Generate response using OpenAI
+
+@router.post("", response_model=ChatResponse)
+async def chat(request: ChatRequest, response: Response):
+    timer = StageTimer()
     try:
-        response = await llm.generate_response(
-            prompt, response_format=Config.RESPONSE_FORMAT
-        )
-        if response.refusal:
-            return ChatResponse(
-                answer="I'm sorry, I don't have enough context to answer that question.",
-                links=[],
+        answer = await answer_chat(request, timer)
+    except HTTPException as e:
+        raise timed_error(e, timer)
+    finally:
+        timer.finish("chat")
+    response.headers["Server-Timing"] = timer.header()
+    return answer
+
+
+async def answer_chat(request: ChatRequest, timer: StageTimer) -> ChatResponse:
+    query_embedding, version, answer, prompt = await prepare_chat(request, timer)
+    if answer is not None:
+        return answer
+
+    # 7. Generate response using OpenAI
+    try:
+        with timer.stage("llm"):
+            response = await llm.generate_response(
+                prompt, response_format=Config.RESPONSE_FORMAT  # type: ignore
             )
+        if response.refusal:
+            ANSWERS.inc(source="refusal")
+            return ChatResponse(answer=NO_CONTEXT_ANSWER, links=[])
 
-        data = json.loads(response.content.strip())
-        return ChatResponse(answer=data["answer"], links=data["links"])
+        with timer.stage("parse"):
+            data = json.loads(response.content.strip())
+            answer = ChatResponse(answer=data["answer"], links=data["links"])
     except Exception as e:
+        ANSWERS.inc(source="error")
         raise HTTPException(status_code=500, detail=f"OpenAI API error: {e}")
 
+    ANSWERS.inc(source="llm")
+    if query_embedding is not None:
+        semantic_cache.put(query_embedding, answer, version)
+    return answer
+
+
+def sse_event(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.post("/stream")
+async def chat_stream(request: ChatRequest):
+    """Stream the answer as server-sent events.
+
+    Emits ``token`` events (``{"text": ...}``) as the answer is generated and a
+    final ``done`` event carrying the full ``answer`` and parsed ``links``.
+    Failures after the stream has started are reported as an ``error`` event.
+    The ``Server-Timing`` header covers the stages before streaming starts.
+    """
+    timer = StageTimer()
+    # Errors during retrieval still surface as regular HTTP errors
+    try:
+        query_embedding, version, answer, prompt = await prepare_chat(request, timer)
+    except HTTPException as e:
+        timer.finish("stream")
+        raise timed_error(e, timer)
+    except Exception:
+        timer.finish("stream")
+        raise
+
+    async def events():
+        try:
+            async for event in stream_events(
+                query_embedding, version, answer, prompt, timer
+            ):
+                yield event
+        finally:
+            timer.finish("stream")
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            "Server-Timing": timer.header(),
+        },
+    )
+
+
+async def stream_events(
+    query_embedding: Optional[np.ndarray],
+    version: Hashable,
+    answer: Optional[ChatResponse],
+    prompt: Optional[str],
+    timer: StageTimer,
+) -> AsyncIterator[str]:
+    if answer is not None:
+        yield sse_event("token", {"text": answer.answer})
+        yield sse_event("done", answer.model_dump())
+        return
+
+    parser = AnswerStreamParser()
+    content = []
+    started = time.perf_counter()
+    try:
+        async for delta in llm.stream_response(
+            prompt, response_format=Config.RESPONSE_FORMAT  # type: ignore
+        ):
+            if not content:
+                timer.record("first_token", time.perf_counter() - started)
+            content.append(delta)
+            text = parser.feed(delta)
+            if text:
+                yield sse_event("token", {"text": text})
+        timer.record("llm", time.perf_counter() - started)
+
+        raw = "".join(content).strip()
+        if not raw:  # The model refused
+            ANSWERS.inc(source="refusal")
+            final = ChatResponse(answer=NO_CONTEXT_ANSWER, links=[])
+            yield sse_event("token", {"text": final.answer})
+        else:
+            with timer.stage("parse"):
+                data = json.loads(raw)
+                final = ChatResponse(answer=data["answer"], links=data["links"])
+            ANSWERS.inc(source="llm")
+    except Exception as e:
+        ANSWERS.inc(source="error")
+        yield sse_event("error", {"detail": f"OpenAI API error: {e}"})
+        return
+
+    if query_embedding is not None:
+        semantic_cache.put(query_embedding, final, version)
+    yield sse_event("done", final.model_dump())
+
+
+@router.get("/stats")
+async def stats():
+    return {
+        "embedding_cache": llm.embed_cache.stats() if llm.embed_cache else None,
+        "semantic_cache": semantic_cache.stats(),
+        "retrieval": {
+            "mode": Config.RETRIEVAL_MODE,
+            **{
+                mode: int(RETRIEVALS.value(mode=mode))
+                for mode in ("dense", "hybrid", "lexical")
+            },
+        },
+        "memory": process_memory(),
+    }
+
+
+def require_admin(authorization: Optional[str] = Header(None)):
+    """Allow a request only with ``Authorization: Bearer $ADMIN_TOKEN``."""
+    if not Config.ADMIN_TOKEN:
+        # No token configured: the admin routes don't exist
+        raise HTTPException(status_code=404, detail="Not Found")
+    expected = f"Bearer {Config.ADMIN_TOKEN}".encode("utf-8")
+    if not authorization or not secrets.compare_digest(
+        authorization.encode("utf-8"), expected
+    ):
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid or missing admin token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+@router.post("/reload", dependencies=[Depends(require_admin)])
+async def reload_index():
+    """Pick up a rebuilt index without restarting; in-flight requests are unaffected."""
+    reloaded = await faiss.reload()
+    if reloaded:
+        semantic_cache.bind(faiss.version)
+    return {"reloaded": reloaded, "vectors": faiss.index.ntotal}
+
+
+@router.put(
+    "/search-params",
+    response_model=SearchParams,
+    dependencies=[Depends(require_admin)],
+)
+async def update_search_params(params: SearchParams):
+    try:
+        faiss.set_search_params(nprobe=params.nprobe, ef_search=params.ef_search)
+    except (ValueError, OverflowError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return SearchParams(nprobe=faiss.nprobe, ef_search=faiss.ef_search)
+
 
 def include_router(app):
     app.include_router(router)
@@ -8,6 +8,69 @@ class Config:
     SIMILARITY_THRESHOLD = 0.35  # Cosine similarity threshold
     FAISS_INDEX_PATH = "model/virtual-ta.faiss"
     METADATA_PATH = "model/metadata.json"
+    CHUNK_STORE_PATH = "model/chunks.bin"  # Used instead of METADATA_PATH if present
+    # Sections the chunks were cut from; hits covering at least
+    # PARENT_EXPAND_RATIO of a section are replaced by the whole section
+    PARENT_STORE_PATH = "model/parents.bin"
+    PARENT_EXPAND_RATIO = float(os.getenv("PARENT_EXPAND_RATIO", "0.5"))
+    # Rewritten by create_vector_db.py once every other file of a build is in
+    # place; the server reloads when it changes
+    BUILD_MARKER_PATH = "model/build.json"
+    # Bearer token for /api/reload and /api/search-params; unset disables them
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+    # Memory-map the FAISS index read-only instead of copying it into RAM
+    FAISS_MMAP = os.getenv("FAISS_MMAP", "true").lower() in ("1", "true", "yes")
+    # Read the index files and open an API connection before serving requests
+    WARMUP = os.getenv("WARMUP", "false").lower() in ("1", "true", "yes")
+    # Seconds between checks for a rebuilt index on disk; 0 disables the watcher
+    INDEX_WATCH_INTERVAL = float(os.getenv("INDEX_WATCH_INTERVAL", "30"))
+    # Index used when no index file exists yet: flat, ivf, hnsw, ivfpq, sq8 or fp16
+    FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat")
+    FAISS_INDEX_PARAMS = {
+        "nlist": int(os.getenv("FAISS_NLIST", "1024")),
+        "hnsw_m": int(os.getenv("FAISS_HNSW_M", "32")),
+        "hnsw_ef_construction": int(os.getenv("FAISS_HNSW_EF_CONSTRUCTION", "200")),
+        "pq_m": int(os.getenv("FAISS_PQ_M", "64")),
+        "pq_nbits": int(os.getenv("FAISS_PQ_NBITS", "8")),
+    }
+    FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))  # IVF lists probed per query
+    FAISS_BATCH_SIZE = int(os.getenv("FAISS_BATCH_SIZE", "64"))  # Max query rows
+    FAISS_BATCH_WAIT_MS = float(os.getenv("FAISS_BATCH_WAIT_MS", "2"))  # 0 disables
+    FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))  # HNSW search depth
+    # Full-precision vectors written by create_vector_db.py --full-vectors; when
+    # present, quantized hits are re-ranked from FAISS_RESCORE_FACTOR * k
+    # candidates (1 disables re-scoring)
+    VECTORS_PATH = "model/vectors.npy"
+    FAISS_RESCORE_FACTOR = int(os.getenv("FAISS_RESCORE_FACTOR", "4"))
+    BM25_INDEX_PATH = "model/bm25.npz"
+    # dense (FAISS only), lexical (BM25 only) or hybrid (BM25 + FAISS with
+    # reciprocal rank fusion); lexical modes need BM25_INDEX_PATH to exist
+    RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "dense")
+    # A BM25 hit this strong skips the embeddings call in hybrid mode
+    LEXICAL_MIN_COVERAGE = float(os.getenv("LEXICAL_MIN_COVERAGE", "0.8"))
+    LEXICAL_MIN_MARGIN = float(os.getenv("LEXICAL_MIN_MARGIN", "1.5"))
+    RRF_K = int(os.getenv("RRF_K", "60"))
+    EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "4096"))
+    EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "")  # Empty disables disk tier
+    SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+    SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))  # Seconds
+    SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "1024"))  # 0 disables
+    PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "12000"))
+    # Processes per OCR pool; each uvicorn worker has its own pool, so the
+    # default splits the cores between WEB_CONCURRENCY (uvicorn --workers) workers
+    OCR_WORKERS = int(
+        os.getenv("OCR_WORKERS")
+        or max(1, (os.cpu_count() or 1) // int(os.getenv("WEB_CONCURRENCY") or 1))
+    )
+    OCR_MAX_PENDING = int(os.getenv("OCR_MAX_PENDING", "32"))
+    OCR_TIMEOUT = float(os.getenv("OCR_TIMEOUT", "30"))  # Seconds per OCR job
+    # Image limits and preprocessing before tesseract; 0 disables a limit or step
+    OCR_MAX_IMAGE_BYTES = int(os.getenv("OCR_MAX_IMAGE_BYTES", str(10 * 1024 * 1024)))
+    OCR_MAX_PIXELS = int(os.getenv("OCR_MAX_PIXELS", "40000000"))
+    OCR_MAX_WIDTH = int(os.getenv("OCR_MAX_WIDTH", "1800"))  # Wider is downscaled
+    OCR_TARGET_DPI = int(os.getenv("OCR_TARGET_DPI", "300"))
+    OCR_BINARIZE = os.getenv("OCR_BINARIZE", "true").lower() in ("1", "true", "yes")
+    OCR_TILE_HEIGHT = int(os.getenv("OCR_TILE_HEIGHT", "2000"))  # Taller is tiled
     RESPONSE_FORMAT = {
         "type": "json_schema",
         "json_schema": {
@@ -0,0 +1,228 @@
+"""Minimal Prometheus-style metrics and per-request stage timing.
+
+Metrics live in the process that records them, so with several uvicorn
+workers each worker reports its own series (scrape them per process, or run
+one worker per container).
+"""
+
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+TOKEN_BUCKETS = (250, 500, 1000, 2000, 4000, 8000, 12000, 16000, 32000)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 15, 20, 30, 50)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], **extra) -> str:
+    pairs = list(zip(names, values)) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in pairs) + "}"
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value:g}")
+        return lines
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: per-bucket counts (plus +Inf), sum
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._series.setdefault(
+                key, ([0] * (len(self.buckets) + 1), [0.0])
+            )
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            total[0] += value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for key, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                labels = _format_labels(self.labelnames, key, le=le)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total[0]:g}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for m in self.metrics for line in m.render()) + "\n"
+
+
+registry = Registry()
+STAGE_SECONDS: Histogram = registry.register(  # type: ignore
+    Histogram(
+        "virtual_ta_stage_seconds",
+        "Time spent in each stage of a chat request.",
+        ["stage"],
+    )
+)
+REQUEST_SECONDS: Histogram = registry.register(  # type: ignore
+    Histogram(
+        "virtual_ta_request_seconds",
+        "End-to-end chat request latency.",
+        ["route"],
+    )
+)
+PROMPT_TOKENS: Histogram = registry.register(  # type: ignore
+    Histogram(
+        "virtual_ta_prompt_tokens",
+        "Tokens in the prompt sent to the LLM.",
+        buckets=TOKEN_BUCKETS,
+    )
+)
+RETRIEVAL_HITS: Histogram = registry.register(  # type: ignore
+    Histogram(
+        "virtual_ta_retrieval_hits",
+        "Chunks retrieved per request, before excerpt de-duplication.",
+        buckets=COUNT_BUCKETS,
+    )
+)
+RETRIEVALS: Counter = registry.register(  # type: ignore
+    Counter(
+        "virtual_ta_retrievals_total",
+        "Requests by how their context was retrieved.",
+        ["mode"],
+    )
+)
+ANSWERS: Counter = registry.register(  # type: ignore
+    Counter(
+        "virtual_ta_answers_total",
+        "Answers by where they came from.",
+        ["source"],
+    )
+)
+
+
+class StageTimer:
+    """Time the stages of one request for ``Server-Timing`` and the histograms."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages: List[Tuple[str, float]] = []
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float):
+        self.stages.append((name, seconds))
+        STAGE_SECONDS.observe(seconds, stage=name)
+
+    def finish(self, route: str):
+        REQUEST_SECONDS.observe(time.perf_counter() - self.start, route=route)
+
+    def header(self) -> str:
+        """Render the stages recorded so far as a ``Server-Timing`` header value."""
+        total = time.perf_counter() - self.start
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages]
+        parts.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+
+def process_memory() -> Optional[Dict[str, int]]:
+    """This process's resident memory in bytes, split into shared and private.
+
+    Memory-mapped index files count as shared: every worker maps the same
+    pages. Linux only; ``None`` elsewhere.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            _, resident, shared = (int(v) for v in f.read().split()[:3])
+    except (OSError, ValueError):
+        return None
+    page = os.sysconf("SC_PAGE_SIZE")
+    return {
+        "resident": resident * page,
+        "shared": shared * page,
+        "private": (resident - shared) * page,
+    }
@@ -1,21 +1,81 @@
 import json
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple
+
+import tiktoken
 
 
 class TemplateManager:
-    def __init__(self):
+    def __init__(
+        self,
+        max_prompt_tokens: Optional[int] = None,
+        model: str = "gpt-4o-mini",
+        min_excerpt_tokens: int = 100,
+    ):
         self.template = (
             "Always cite sources in links only.\n\n"
             "Answer based solely on the following excerpts:\n\n"
         )
+        self.max_prompt_tokens = max_prompt_tokens
+        self.model = model
+        self.min_excerpt_tokens = min_excerpt_tokens
+        self._encoding: Optional[tiktoken.Encoding] = None
+
+    @property
+    def encoding(self) -> tiktoken.Encoding:
+        # Loaded on first use (routes.init_resources does so at startup);
+        # tiktoken may need to fetch the BPE file
+        if self._encoding is None:
+            self._encoding = tiktoken.encoding_for_model(self.model)
+        return self._encoding
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
 
     def build_prompt(
         self, excerpts: List[Tuple[str, Dict]], augmented_query: str
     ) -> str:
-        prompt = self.template
+        return self.build_prompt_with_usage(excerpts, augmented_query)[0]
+
+    def build_prompt_with_usage(
+        self, excerpts: List[Tuple[str, Dict]], augmented_query: str
+    ) -> Tuple[str, int]:
+        """Build the prompt and return it with its token count.
+
+        Excerpts are expected in descending relevance. Once
+        ``max_prompt_tokens`` would be exceeded, the first excerpt that does not
+        fit is truncated (if at least ``min_excerpt_tokens`` remain) and every
+        lower-ranked excerpt is dropped.
+        """
+        question = f"QUESTION: {augmented_query}\nANSWER:"
+        parts = [self.template]
+        used = self.count_tokens(self.template) + self.count_tokens(question)
+
         for i, (text, meta) in enumerate(excerpts, start=1):
-            prompt += f"Excerpt [{i}] (source: {meta['source']} | chunk_id: {meta.get('chunk_id')}):\n{text}\n\n"
-        return prompt + f"QUESTION: {augmented_query}\nANSWER:"
+            header = f"Excerpt [{i}] (source: {meta['source']} | chunk_id: {meta.get('chunk_id')}):\n"
+            piece = f"{header}{text}\n\n"
+            if self.max_prompt_tokens is None:
+                parts.append(piece)
+                used += self.count_tokens(piece)
+                continue
+
+            tokens = self.count_tokens(piece)
+            remaining = self.max_prompt_tokens - used
+            if tokens <= remaining:
+                parts.append(piece)
+                used += tokens
+                continue
+
+            room = remaining - self.count_tokens(header) - 2
+            if room >= self.min_excerpt_tokens:
+                text_tokens = self.encoding.encode(text, disallowed_special=())
+                trimmed = self.encoding.decode(text_tokens[:room])
+                piece = f"{header}{trimmed}\n\n"
+                parts.append(piece)
+                used += self.count_tokens(piece)
+            break
+
+        parts.append(question)
+        return "".join(parts), used
 
     def parse_response(self, response: str) -> Dict:
         try:
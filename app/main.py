@@ -1,9 +1,34 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 from app import __version__
+from app.api import routes
 from app.api.routes import router as api_router
+from app.core.config import Config
+from app.core.metrics import registry
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The server only starts accepting requests once this block yields, so a
+    # warmed-up worker is ready to serve as soon as it is reachable
+    routes.init_resources()
+    if Config.WARMUP:
+        await routes.warmup()
+    watcher = None
+    if Config.INDEX_WATCH_INTERVAL > 0:
+        watcher = asyncio.create_task(routes.faiss.watch(Config.INDEX_WATCH_INTERVAL))
+    try:
+        yield
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        await routes.close_resources()
+
 
 app = FastAPI(
     title="Virtual TA API",
@@ -15,6 +40,7 @@ app = FastAPI(
             "description": "Endpoints for interacting with the Virtual TA API.",
         },
     ],
+    lifespan=lifespan,
 )
 app.router.redirect_slashes = False
 
@@ -28,16 +54,6 @@ app.add_middleware(
 )
 
 
-@app.on_event("startup")
-async def startup_event():
-    pass
-
-
-@app.on_event("shutdown")
-async def shutdown_event():
-    pass
-
-
 @app.middleware("http")
 async def strip_trailing_slash(request: Request, call_next):
     scope = request.scope
@@ -92,4 +108,12 @@ async def health_check():
     return {"status": "ok"}
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus text exposition of this worker's stage timings and counters."""
+    return PlainTextResponse(
+        registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 app.include_router(api_router, prefix="/api", tags=["API"])
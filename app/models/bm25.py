@@ -0,0 +1,193 @@
+"""BM25 keyword index over the same chunks as the FAISS index.
+
+Stored as an uncompressed ``.npz`` next to the FAISS index: the sorted
+vocabulary (fixed-width UTF-8), CSR-style postings (``offsets`` into
+``ids``/``tfs``) and the token length of every chunk. Ids are positions in the
+chunk metadata, so lexical and dense hits can be fused directly; tombstoned
+chunks have length 0. The arrays are memory-mapped straight out of the file,
+so every worker process shares one copy through the page cache.
+"""
+
+import math
+import os
+import re
+import struct
+import zipfile
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+TOKEN_RE = re.compile(r"\w+")
+MAX_TOKEN_LEN = 40  # Longer "words" are base64 blobs, hashes and the like
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_RE.findall(text.lower()) if len(t) <= MAX_TOKEN_LEN]
+
+
+def write_bm25_index(path: str, records: Iterable[Optional[Dict]]) -> int:
+    """Build postings for the ``text`` of each record and save them to ``path``."""
+    postings: Dict[str, List[Tuple[int, int]]] = {}
+    doc_lens = []
+    for i, record in enumerate(records):
+        counts = Counter(tokenize(record["text"])) if record is not None else {}
+        doc_lens.append(sum(counts.values()))
+        for term, tf in counts.items():
+            postings.setdefault(term, []).append((i, tf))
+
+    terms = sorted(postings)
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(postings[t]) for t in terms])
+    pairs = np.array(
+        [pair for t in terms for pair in postings[t]], dtype=np.int64
+    ).reshape(-1, 2)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            vocab=np.array([t.encode("utf-8") for t in terms], dtype=np.bytes_),
+            offsets=offsets,
+            ids=pairs[:, 0].astype(np.int32),
+            tfs=pairs[:, 1].astype(np.float32),
+            doc_lens=np.array(doc_lens, dtype=np.float32),
+        )
+    os.replace(tmp_path, path)
+    return len(doc_lens)
+
+
+def load_npz_mmap(path: str) -> Dict[str, np.ndarray]:
+    """Memory-map every array of an uncompressed ``.npz`` (as ``np.savez`` writes)."""
+    arrays = {}
+    with zipfile.ZipFile(path) as zf, open(path, "rb") as f:
+        for info in zf.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"{path}: {info.filename} is compressed")
+            # The member's data follows its local header (30 bytes + name + extra)
+            f.seek(info.header_offset + 26)
+            name_len, extra_len = struct.unpack("<HH", f.read(4))
+            f.seek(info.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+            name = info.filename[: -len(".npy")]
+            if math.prod(shape) == 0:
+                arrays[name] = np.empty(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(
+                    path,
+                    dtype=dtype,
+                    mode="r",
+                    offset=f.tell(),
+                    shape=shape,
+                    order="F" if fortran else "C",
+                )
+    return arrays
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[Tuple[int, float]]], k: int = 60
+) -> List[Tuple[int, float]]:
+    """Fuse ranked ``(id, score)`` lists by summing ``1 / (k + rank)`` per id."""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, (idx, _) in enumerate(ranking, start=1):
+            fused[idx] = fused.get(idx, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda hit: hit[1], reverse=True)
+
+
+class BM25Index:
+    def __init__(
+        self,
+        vocab: np.ndarray,
+        offsets: np.ndarray,
+        ids: np.ndarray,
+        tfs: np.ndarray,
+        doc_lens: np.ndarray,
+        k1: float = 1.2,
+        b: float = 0.75,
+    ):
+        self.vocab = vocab  # Sorted UTF-8 terms, looked up by binary search
+        self.offsets = offsets
+        self.ids = ids
+        self.tfs = tfs
+        self.doc_lens = doc_lens
+        self.k1 = k1
+        self.b = b
+
+        self.n_docs = int(np.count_nonzero(doc_lens))
+        self.avg_len = float(doc_lens.sum() / self.n_docs) if self.n_docs else 1.0
+
+    def _row(self, term: str) -> Optional[int]:
+        key = term.encode("utf-8")
+        row = int(np.searchsorted(self.vocab, key))
+        if row < len(self.vocab) and self.vocab[row] == key:
+            return row
+        return None
+
+    def _idf(self, row: Optional[int]) -> float:
+        # Computed per query term instead of stored, to keep workers lean; a
+        # term the corpus has never seen (row None) gets the highest idf
+        df = 0 if row is None else int(self.offsets[row + 1] - self.offsets[row])
+        return math.log1p((self.n_docs - df + 0.5) / (df + 0.5))
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(path)
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "BM25Index":
+        data = load_npz_mmap(path)
+        return cls(
+            data["vocab"],
+            data["offsets"],
+            data["ids"],
+            data["tfs"],
+            data["doc_lens"],
+            **kwargs,
+        )
+
+    def __len__(self) -> int:
+        return len(self.doc_lens)
+
+    def search(self, query: str, k: int = 15) -> List[Tuple[int, float]]:
+        """Return up to ``k`` ``(id, score)`` hits in descending score order."""
+        scores = np.zeros(len(self.doc_lens), dtype=np.float32)
+        for term in set(tokenize(query)):
+            row = self._row(term)
+            if row is None:
+                continue
+            lo, hi = self.offsets[row], self.offsets[row + 1]
+            ids, tfs = self.ids[lo:hi], self.tfs[lo:hi]
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lens[ids] / self.avg_len)
+            scores[ids] += self._idf(row) * tfs * (self.k1 + 1) / (tfs + norm)
+
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top if scores[i] > 0]
+
+    def is_decisive(
+        self,
+        query: str,
+        hits: Sequence[Tuple[int, float]],
+        min_coverage: float = 0.8,
+        min_margin: float = 1.5,
+    ) -> bool:
+        """Whether the top hit is a clear enough keyword match to skip dense search.
+
+        The top score must reach ``min_coverage`` of the query's total IDF (a
+        chunk containing every query term once, at average length, scores about
+        100%) and beat the runner-up by a factor of ``min_margin``.
+        """
+        if not hits:
+            return False
+        ceiling = sum(self._idf(self._row(t)) for t in set(tokenize(query)))
+        top = hits[0][1]
+        runner_up = hits[1][1] if len(hits) > 1 else 0.0
+        return top >= min_coverage * ceiling and top >= min_margin * runner_up
@@ -0,0 +1,248 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.split()).lower()
+
+
+class EmbeddingCache:
+    """Two-tier embedding cache: an in-process LRU backed by an optional SQLite file.
+
+    The SQLite tier survives restarts and, thanks to WAL mode, can be shared by
+    every uvicorn worker pointing at the same ``path``.
+    """
+
+    def __init__(self, max_entries: int = 4096, path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.path = path
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()  # Memory tier and counters
+        self._db_lock = threading.Lock()  # Serializes use of the SQLite connection
+        self._db: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if path:
+            self._open_db(path)
+
+    def _open_db(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Requests reach it only via worker threads, so a busy wait never blocks the loop
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vec BLOB NOT NULL)"
+        )
+        self._db.commit()
+
+    @staticmethod
+    def make_key(text: str, model: str) -> str:
+        digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+        return f"{model}:{digest}"
+
+    def get(self, text: str, model: str) -> Optional[np.ndarray]:
+        return self._lookup([self.make_key(text, model)])[0]
+
+    async def get_many(
+        self, texts: List[str], model: str
+    ) -> List[Optional[np.ndarray]]:
+        """Look up several texts; SQLite reads run in a thread, off the event loop."""
+        keys = [self.make_key(text, model) for text in texts]
+        with self._lock:
+            found = [self._from_memory(key) for key in keys]
+        missing = [i for i, vec in enumerate(found) if vec is None]
+        if missing:
+            if self._db is not None:
+                from_disk = await asyncio.to_thread(
+                    self._lookup, [keys[i] for i in missing], False
+                )
+            else:
+                from_disk = [None] * len(missing)
+                with self._lock:
+                    self.misses += len(missing)
+            for i, vec in zip(missing, from_disk):
+                found[i] = vec
+        return found
+
+    def _from_memory(self, key: str) -> Optional[np.ndarray]:
+        vec = self._memory.get(key)
+        if vec is not None:
+            self._memory.move_to_end(key)
+            self.hits += 1
+        return vec
+
+    def _lookup(
+        self, keys: List[str], check_memory: bool = True
+    ) -> List[Optional[np.ndarray]]:
+        found: List[Optional[np.ndarray]] = []
+        for key in keys:
+            vec = None
+            if check_memory:
+                with self._lock:
+                    vec = self._from_memory(key)
+            if vec is None and self._db is not None:
+                row = None
+                with self._db_lock:
+                    if self._db is not None:  # Not closed meanwhile
+                        row = self._db.execute(
+                            "SELECT vec FROM embeddings WHERE key = ?", (key,)
+                        ).fetchone()
+                if row is not None:
+                    vec = np.frombuffer(row[0], dtype=np.float32)
+                    with self._lock:
+                        self._remember(key, vec)
+                        self.disk_hits += 1
+            if vec is None:
+                with self._lock:
+                    self.misses += 1
+            found.append(vec)
+        return found
+
+    def put(self, text: str, model: str, vec: np.ndarray, wait: bool = True):
+        """Cache ``vec``; with ``wait=False`` the SQLite write runs in the background."""
+        key = self.make_key(text, model)
+        vec = np.asarray(vec, dtype=np.float32)
+        with self._lock:
+            self._remember(key, vec)
+        if self._db is None:
+            return
+        if wait:
+            self._write(key, vec)
+        else:
+            # Fire and forget: a slow or locked database never delays a request
+            asyncio.get_running_loop().run_in_executor(None, self._write, key, vec)
+
+    def _write(self, key: str, vec: np.ndarray):
+        with self._db_lock:
+            if self._db is None:  # Closed while the write was queued
+                return
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, vec) VALUES (?, ?)",
+                    (key, vec.tobytes()),
+                )
+                self._db.commit()
+            except sqlite3.OperationalError:
+                # Another worker holds the write lock; the memory tier still has it
+                pass
+
+    def _remember(self, key: str, vec: np.ndarray):
+        self._memory[key] = vec
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._memory),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+        }
+
+    def close(self):
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class SemanticCache:
+    """Answer cache looked up by query-embedding similarity instead of exact text.
+
+    Past query embeddings live in a small inner-product FAISS index whose ids
+    map to the cached value. Entries expire after ``ttl`` seconds, the least
+    recently used entry is evicted beyond ``max_entries``, and everything is
+    dropped whenever the main index ``version`` changes.
+    """
+
+    def __init__(
+        self,
+        embed_dim: int,
+        similarity_threshold: float = 0.95,
+        ttl: float = 3600.0,
+        max_entries: int = 1024,
+    ):
+        self.embed_dim = embed_dim
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.index = faiss.IndexIDMap(faiss.IndexFlatIP(embed_dim))
+        self._entries: "OrderedDict[int, Tuple[float, Any]]" = OrderedDict()
+        self._next_id = 0
+        self.version: Optional[Hashable] = None
+        self.hits = 0
+        self.misses = 0
+
+    def bind(self, version: Hashable):
+        """Tie the cache to a main-index version, clearing it if that changed."""
+        if version != self.version:
+            self.clear()
+            self.version = version
+
+    def clear(self):
+        self.index.reset()
+        self._entries.clear()
+
+    def _remove(self, ids):
+        self.index.remove_ids(np.asarray(ids, dtype=np.int64))
+        for i in ids:
+            self._entries.pop(i, None)
+
+    def get(self, query_embedding: np.ndarray) -> Optional[Any]:
+        if self.index.ntotal == 0:
+            self.misses += 1
+            return None
+
+        query = np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
+        k = min(4, self.index.ntotal)
+        scores, ids = self.index.search(query, k)  # type: ignore
+        now = time.monotonic()
+        expired = []
+        result = None
+        for i, score in zip(ids[0], scores[0]):
+            i = int(i)
+            if i < 0 or score < self.similarity_threshold:
+                break
+            created, value = self._entries[i]
+            if now - created > self.ttl:
+                expired.append(i)
+                continue
+            self._entries.move_to_end(i)
+            result = value
+            break
+
+        if expired:
+            self._remove(expired)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def put(self, query_embedding: np.ndarray, value: Any, version: Hashable):
+        """Cache ``value``, unless it was computed against another index ``version``."""
+        # A reload while the answer was being generated must not let it outlive the clear
+        if self.max_entries <= 0 or version != self.version:
+            return
+        query = np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
+        entry_id = self._next_id
+        self._next_id += 1
+        self.index.add_with_ids(query, np.array([entry_id], dtype=np.int64))  # type: ignore
+        self._entries[entry_id] = (time.monotonic(), value)
+        if len(self._entries) > self.max_entries:
+            self._remove(list(self._entries)[: len(self._entries) - self.max_entries])
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
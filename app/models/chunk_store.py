@@ -0,0 +1,103 @@
+"""Compact, memory-mapped store for chunk text and metadata.
+
+Layout: ``<path>`` is a blob of UTF-8 JSON records laid end to end and
+``<path>.idx`` is a ``.npy`` array of ``n + 1`` uint64 byte offsets into it.
+Records are only decoded when asked for by id, so opening a store is O(1)
+regardless of corpus size and the OS page cache is shared by every process.
+
+Convert an existing ``metadata.json`` with::
+
+    python -m app.models.chunk_store model/metadata.json model/chunks.bin
+"""
+
+import argparse
+import json
+import mmap
+import os
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+
+def offsets_path(path: str) -> str:
+    return f"{path}.idx"
+
+
+def write_chunk_store(path: str, records: Iterable[Dict]) -> int:
+    """Write ``records`` to a chunk store at ``path``; returns the record count."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    offsets = [0]
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as blob:
+        for record in records:
+            data = json.dumps(record, ensure_ascii=False).encode("utf-8")
+            blob.write(data)
+            offsets.append(offsets[-1] + len(data))
+
+    tmp_idx = f"{offsets_path(path)}.tmp"
+    with open(tmp_idx, "wb") as f:
+        np.save(f, np.array(offsets, dtype=np.uint64))
+
+    # Swap both files in only once they are complete
+    os.replace(tmp_path, path)
+    os.replace(tmp_idx, offsets_path(path))
+    return len(offsets) - 1
+
+
+class ChunkStore:
+    def __init__(self, path: str):
+        self.path = path
+        self.offsets = np.load(offsets_path(path), mmap_mode="r")
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        # mmap refuses zero-length files
+        self._blob = (
+            mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        )
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(path) and os.path.exists(offsets_path(path))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx: int) -> Dict:
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"chunk id {idx} out of range")
+        start, end = int(self.offsets[idx]), int(self.offsets[idx + 1])
+        return json.loads(self._blob[start:end].decode("utf-8"))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def get_many(self, ids: Iterable[int]) -> List[Dict]:
+        return [self[i] for i in ids]
+
+    def close(self):
+        if isinstance(self._blob, mmap.mmap):
+            self._blob.close()
+        self._file.close()
+
+
+def main():
+    p = argparse.ArgumentParser(
+        description="Convert a metadata.json list into a memory-mapped chunk store."
+    )
+    p.add_argument("metadata", help="Path to metadata.json")
+    p.add_argument(
+        "output", help="Path of the chunk store blob (e.g. model/chunks.bin)"
+    )
+    args = p.parse_args()
+
+    with open(args.metadata, encoding="utf-8") as f:
+        metadata = json.load(f)
+    count = write_chunk_store(args.output, metadata)
+    print(f"Wrote {count} chunks to {args.output} (+ {offsets_path(args.output)})")
+
+
+if __name__ == "__main__":
+    main()
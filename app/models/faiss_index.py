@@ -1,9 +1,148 @@
-from typing import List, Dict, Tuple
+import asyncio
+from typing import List, Dict, NamedTuple, Optional, Sequence, Set, Tuple
 import faiss
 import numpy as np
 import json
 import os
 
+from app.models.bm25 import BM25Index
+from app.models.chunk_store import ChunkStore, write_chunk_store
+
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq", "sq8", "fp16")
+SCALAR_QUANTIZERS = {
+    "sq8": faiss.ScalarQuantizer.QT_8bit,  # 1 byte per dimension
+    "fp16": faiss.ScalarQuantizer.QT_fp16,  # 2 bytes per dimension
+}
+
+
+def create_index(
+    embed_dim: int,
+    index_type: str = "flat",
+    nlist: int = 1024,
+    hnsw_m: int = 32,
+    hnsw_ef_construction: int = 200,
+    pq_m: int = 64,
+    pq_nbits: int = 8,
+) -> faiss.Index:
+    """Create an empty inner-product index of the requested type.
+
+    ``ivf``, ``ivfpq`` and ``sq8`` indexes must be trained before vectors are
+    added.
+    """
+    if index_type == "flat":
+        return faiss.IndexFlatIP(embed_dim)
+    if index_type in SCALAR_QUANTIZERS:
+        return faiss.IndexScalarQuantizer(
+            embed_dim, SCALAR_QUANTIZERS[index_type], faiss.METRIC_INNER_PRODUCT
+        )
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(embed_dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = hnsw_ef_construction
+        return index
+    if index_type == "ivf":
+        quantizer = faiss.IndexFlatIP(embed_dim)
+        return faiss.IndexIVFFlat(
+            quantizer, embed_dim, nlist, faiss.METRIC_INNER_PRODUCT
+        )
+    if index_type == "ivfpq":
+        quantizer = faiss.IndexFlatIP(embed_dim)
+        return faiss.IndexIVFPQ(
+            quantizer, embed_dim, nlist, pq_m, pq_nbits, faiss.METRIC_INNER_PRODUCT
+        )
+    raise ValueError(
+        f"Unknown index type {index_type!r}; expected one of {', '.join(INDEX_TYPES)}"
+    )
+
+
+def rescore(
+    vectors: np.ndarray, queries: np.ndarray, candidates: np.ndarray, k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Re-rank candidate ids by exact inner product with full-precision vectors.
+
+    ``vectors`` is typically memory-mapped, so only candidate rows are read.
+    Returns ``(distances, indices)`` shaped like ``index.search`` output.
+    """
+    distances = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    indices = np.full((len(queries), k), -1, dtype=np.int64)
+    for row, (query, ids) in enumerate(zip(queries, candidates)):
+        ids = np.unique(ids[ids >= 0])  # Sorted, so the mmap is read in order
+        if not len(ids):
+            continue
+        scores = vectors[ids] @ query
+        top = np.argsort(-scores)[:k]
+        distances[row, : len(top)] = scores[top]
+        indices[row, : len(top)] = ids[top]
+    return distances, indices
+
+
+def max_id(index: faiss.Index) -> int:
+    """The largest vector id stored in ``index``, or -1 when it is empty."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        ids = faiss.vector_to_array(index.id_map)
+        return int(ids.max()) if len(ids) else -1
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return index.ntotal - 1  # Ids are positions
+    largest = -1
+    for i in range(ivf.nlist):
+        size = ivf.invlists.list_size(i)
+        if size:
+            ids = faiss.rev_swig_ptr(ivf.invlists.get_ids(i), size)
+            largest = max(largest, int(ids.max()))
+    return largest
+
+
+def is_quantized(index: faiss.Index) -> bool:
+    """Whether ``index`` scores lossy codes (sq8, fp16, ivfpq) rather than floats."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    return not isinstance(index, (faiss.IndexFlat, faiss.IndexIVFFlat))
+
+
+def has_ondisk_lists(index: faiss.Index) -> bool:
+    """Whether ``index`` is an IVF index whose lists live in a separate mapped file."""
+    try:
+        invlists = faiss.extract_index_ivf(index).invlists
+    except RuntimeError:
+        return False
+    return isinstance(faiss.downcast_InvertedLists(invlists), faiss.OnDiskInvertedLists)
+
+
+def copy_to_memory(index: faiss.Index) -> faiss.Index:
+    """A heap copy of a memory-mapped or on-disk index, which can be added to."""
+    data = faiss.serialize_index(index)
+    if not has_ondisk_lists(index):
+        return faiss.deserialize_index(data)
+    # Re-read everything but the lists, then copy those over one by one
+    reader = faiss.VectorIOReader()
+    faiss.copy_array_to_vector(data, reader.data)
+    copy = faiss.read_index(reader, faiss.IO_FLAG_SKIP_IVF_DATA)
+    ivf = faiss.extract_index_ivf(index)
+    src = ivf.invlists
+    invlists = faiss.ArrayInvertedLists(ivf.nlist, ivf.code_size)
+    for i in range(ivf.nlist):
+        invlists.add_entries(i, src.list_size(i), src.get_ids(i), src.get_codes(i))
+    invlists.this.disown()
+    faiss.extract_index_ivf(copy).replace_invlists(invlists, True)
+    return copy
+
+
+class IndexSnapshot(NamedTuple):
+    """An index with the metadata it was built with, swapped in as one unit."""
+
+    index: faiss.Index
+    metadata: Sequence[Optional[Dict]]
+    version: Optional[Tuple] = None
+    lexical: Optional[BM25Index] = None  # Keyword index over the same chunk ids
+    vectors: Optional[np.ndarray] = None  # Full-precision rows for re-scoring
+    mapped: bool = False  # Index codes are a read-only view of the file(s)
+    parents: Optional[Sequence[Optional[Dict]]] = None  # Sections chunks expand to
+
 
 class FAISSIndex:
     def __init__(
@@ -12,44 +151,473 @@ class FAISSIndex:
         index_path: str,
         meta_path: str,
         similarity_threshold: float = 0.5,
+        chunk_store_path: Optional[str] = None,
+        index_type: str = "flat",
+        index_params: Optional[Dict] = None,
+        nprobe: int = 16,
+        ef_search: int = 64,
+        bm25_path: Optional[str] = None,
+        vectors_path: Optional[str] = None,
+        rescore_factor: int = 4,
+        mmap: bool = False,
+        parents_path: Optional[str] = None,
+        expand_ratio: float = 0.5,
+        build_marker_path: Optional[str] = None,
     ):
         self.embed_dim = embed_dim
         self.index_path = index_path
         self.meta_path = meta_path
-        self.index = faiss.IndexFlatIP(self.embed_dim)
-        self.metadata: List[Dict] = []
+        self.chunk_store_path = chunk_store_path
+        self.bm25_path = bm25_path
+        # With a quantized index, fetch rescore_factor * k candidates and
+        # re-rank them against the float32 vectors in vectors_path (exact
+        # indexes already score with those floats, so they skip this)
+        self.vectors_path = vectors_path
+        self.rescore_factor = rescore_factor
+        # Map the index file instead of reading it: loading is O(1) and the
+        # pages live in the OS page cache rather than this process's heap
+        self.mmap = mmap
+        # Chunks point into parent sections; see generate_excerpts
+        self.parents_path = parents_path
+        self.expand_ratio = expand_ratio
+        # Written last by each build; while it exists it alone versions the
+        # snapshot, so files of a build that is still writing are never read
+        self.build_marker_path = build_marker_path
+        self.snapshot = IndexSnapshot(
+            create_index(self.embed_dim, index_type, **(index_params or {})), []
+        )
         self.similarity_threshold = similarity_threshold
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self._reload_lock = asyncio.Lock()
         self.load_index()
+        self.set_search_params()
+
+    # The current snapshot is replaced wholesale on reload, so anything that
+    # needs the index and metadata to agree should hold on to ``snapshot``.
+    @property
+    def index(self) -> faiss.Index:
+        return self.snapshot.index
+
+    @index.setter
+    def index(self, value: faiss.Index):
+        self.snapshot = self.snapshot._replace(index=value)
+
+    @property
+    def metadata(self) -> Sequence[Optional[Dict]]:
+        return self.snapshot.metadata
+
+    @metadata.setter
+    def metadata(self, value: Sequence[Optional[Dict]]):
+        self.snapshot = self.snapshot._replace(metadata=value)
+
+    @property
+    def version(self) -> Optional[Tuple]:
+        return self.snapshot.version
 
     def load_index(self):
-        if os.path.exists(self.index_path) and os.path.exists(self.meta_path):
-            self.index = faiss.read_index(self.index_path)
+        snapshot = self._read_snapshot()
+        if snapshot is not None:
+            self.snapshot = snapshot
+
+    def _read_index(self) -> Tuple[faiss.Index, bool]:
+        """Read the index file; returns the index and whether it is mapped."""
+        # On-disk IVF lists (create_vector_db.py --ondisk-ivf) are always
+        # mapped by faiss, from the file next to the index
+        flags = faiss.IO_FLAG_ONDISK_SAME_DIR
+        if self.mmap:
+            try:
+                index = faiss.read_index(
+                    self.index_path,
+                    flags | faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY,
+                )
+                return index, True
+            except RuntimeError:
+                # The mapping reader can't open on-disk lists; what remains
+                # of such an index (the coarse centroids) is small anyway
+                pass
+        index = faiss.read_index(self.index_path, flags)
+        return index, has_ondisk_lists(index)
+
+    def _read_snapshot(self) -> Optional[IndexSnapshot]:
+        if not os.path.exists(self.index_path):
+            return None
+        # Taken before reading so a write racing with the load triggers a reload
+        version = self.snapshot_version()
+        # Prefer the memory-mapped chunk store; metadata.json is the legacy format
+        if self.chunk_store_path and ChunkStore.exists(self.chunk_store_path):
+            index, mapped = self._read_index()
+            metadata: Sequence[Optional[Dict]] = ChunkStore(self.chunk_store_path)
+        elif os.path.exists(self.meta_path):
+            index, mapped = self._read_index()
             with open(self.meta_path, encoding="utf-8") as f:
-                self.metadata = json.load(f)
+                metadata = json.load(f)
+        else:
+            return None
+        parents = None
+        if self.parents_path and ChunkStore.exists(self.parents_path):
+            parents = ChunkStore(self.parents_path)
+        # Files from different builds (a build is still writing) must not be
+        # paired up, or ids would point at the wrong chunks
+        build = self._read_build_marker()
+        if build is not None and (
+            build.get("vectors") != index.ntotal
+            or build.get("chunks") != len(metadata)
+            or (parents is not None and build.get("parents") != len(parents))
+        ):
+            print(
+                f"Not loading {self.index_path}: the files do not match "
+                f"{self.build_marker_path}; is a build still running?"
+            )
+            return None
+        if index.ntotal > len(metadata) or max_id(index) >= len(metadata):
+            print(
+                f"Ignoring {self.index_path}: its {index.ntotal} vectors do not "
+                f"match the {len(metadata)} chunks in the metadata"
+            )
+            return None
+        self._apply_search_params(index)
+        lexical = None
+        if self.bm25_path and BM25Index.exists(self.bm25_path):
+            lexical = BM25Index.load(self.bm25_path)
+            if len(lexical) != len(metadata):
+                print(f"Ignoring {self.bm25_path}: it does not match the metadata")
+                lexical = None
+        vectors = None
+        if self.rescore_factor > 1 and self.vectors_path and is_quantized(index):
+            if os.path.exists(self.vectors_path):
+                vectors = np.load(self.vectors_path, mmap_mode="r")
+                if vectors.shape != (len(metadata), self.embed_dim):
+                    print(
+                        f"Ignoring {self.vectors_path}: it does not match the metadata"
+                    )
+                    vectors = None
+        return IndexSnapshot(
+            index, metadata, version, lexical, vectors, mapped, parents
+        )
+
+    def _read_build_marker(self) -> Optional[Dict]:
+        if not self.build_marker_path or not os.path.exists(self.build_marker_path):
+            return None
+        with open(self.build_marker_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    async def reload(self) -> bool:
+        """Load a changed on-disk snapshot in a worker thread and swap it in.
+
+        Searches already running keep using the snapshot they started with.
+        Returns whether a new snapshot was installed.
+        """
+        async with self._reload_lock:
+            if self.snapshot_version() == self.version:
+                return False
+            snapshot = await asyncio.to_thread(self._read_snapshot)
+            if snapshot is None:
+                return False
+            self.snapshot = snapshot
+            return True
+
+    async def watch(self, interval: float):
+        """Poll the index files and reload once a new snapshot stops changing."""
+        last_seen = self.version
+        while True:
+            await asyncio.sleep(interval)
+            current = self.snapshot_version()
+            # Only reload after the files were stable for a full interval, so a
+            # build that is still writing is never picked up half-way
+            if current != self.version and current == last_seen:
+                try:
+                    await self.reload()
+                except Exception as e:
+                    # Keep serving the old snapshot; retry on the next change
+                    print(f"Failed to reload FAISS index: {e}")
+            last_seen = current
+
+    def set_search_params(
+        self, nprobe: Optional[int] = None, ef_search: Optional[int] = None
+    ):
+        """Apply search-time knobs; safe to call at runtime on any index type."""
+        nprobe = self.nprobe if nprobe is None else nprobe
+        ef_search = self.ef_search if ef_search is None else ef_search
+        if nprobe < 1 or ef_search < 1:
+            raise ValueError("nprobe and ef_search must be at least 1")
+        # Applied before being stored, so a value faiss rejects never reaches
+        # the snapshots loaded on later reloads
+        self._apply_search_params(self.index, nprobe, ef_search)
+        self.nprobe, self.ef_search = nprobe, ef_search
+
+    def _apply_search_params(
+        self,
+        index: faiss.Index,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+    ):
+        try:
+            ivf = faiss.extract_index_ivf(index)
+        except RuntimeError:
+            pass  # Not an IVF index
+        else:
+            ivf.nprobe = self.nprobe if nprobe is None else nprobe
+
+        index = faiss.downcast_index(index)
+        if isinstance(index, faiss.IndexHNSW):
+            index.hnsw.efSearch = self.ef_search if ef_search is None else ef_search
+
+    def snapshot_paths(self) -> List[str]:
+        paths = [self.index_path, self.meta_path]
+        if self.chunk_store_path:
+            paths += [self.chunk_store_path, f"{self.chunk_store_path}.idx"]
+        if self.bm25_path:
+            paths.append(self.bm25_path)
+        if self.vectors_path:
+            paths.append(self.vectors_path)
+        if self.parents_path:
+            paths += [self.parents_path, f"{self.parents_path}.idx"]
+        return paths
+
+    def snapshot_version(self) -> Optional[Tuple]:
+        """Identify the on-disk snapshot by the mtimes and sizes of its files.
+
+        Only the build marker counts once there is one.
+        """
+        if not os.path.exists(self.index_path):
+            return None
+        paths = self.snapshot_paths()
+        if self.build_marker_path and os.path.exists(self.build_marker_path):
+            paths = [self.build_marker_path]
+        version = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+                version.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                version.append(None)
+        return tuple(version)
+
+    def warmup(self, block_size: int = 1 << 24):
+        """Pull the snapshot's files into the page cache and run one search.
+
+        Memory-mapped data is otherwise faulted in by the first requests.
+        """
+        for path in self.snapshot_paths():
+            if os.path.exists(path):
+                with open(path, "rb", buffering=0) as f:
+                    while f.read(block_size):
+                        pass
+        if self.index.ntotal:
+            self.search_snapshot(
+                self.snapshot, np.zeros((1, self.embed_dim), dtype=np.float32), 1
+            )
 
     def add_embeddings(self, embeddings: np.ndarray, metadata: List[Dict]):
+        if self.snapshot.mapped:
+            # A mapped index can't grow; copy it into memory first
+            self.snapshot = self.snapshot._replace(
+                index=copy_to_memory(self.index), mapped=False
+            )
+        if not self.index.is_trained:
+            self.index.train(embeddings)  # type: ignore
         self.index.add(embeddings)  # type: ignore
+        if not isinstance(self.metadata, list):
+            self.metadata = list(self.metadata)
         self.metadata.extend(metadata)
 
     def search(self, query_embedding: np.ndarray, k: int = 5) -> List[Dict]:
-        distances, indices = self.index.search(query_embedding.reshape(1, -1), k)  # type: ignore
+        distances, indices = self.search_snapshot(
+            self.snapshot, query_embedding.reshape(1, -1), k
+        )
         results = []
         for idx, score in zip(indices[0], distances[0]):
             if score >= self.similarity_threshold:  # Ensure valid distance
                 results.append((idx, score))
         return results
 
-    def generate_excerpts(self, relevant: List[Dict]) -> List[Tuple[str, Dict]]:
-        excerpts = []
+    def search_many(
+        self,
+        query_embeddings: np.ndarray,
+        k: int = 5,
+        snapshot: Optional[IndexSnapshot] = None,
+    ) -> List[Dict]:
+        """Search several queries in one ``index.search`` call.
+
+        Hits from all queries are merged, keeping the best score per chunk, and
+        returned in descending score order.
+        """
+        queries = np.ascontiguousarray(
+            query_embeddings.reshape(-1, self.embed_dim), dtype=np.float32
+        )
+        distances, indices = self.search_snapshot(snapshot or self.snapshot, queries, k)
+        return self._merge_hits(distances, indices)
+
+    def search_snapshot(
+        self, snapshot: IndexSnapshot, queries: np.ndarray, k: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """``index.search`` on ``snapshot``, re-scored when it has full vectors."""
+        if snapshot.vectors is None:
+            return snapshot.index.search(queries, k)  # type: ignore
+        _, candidates = snapshot.index.search(queries, k * self.rescore_factor)  # type: ignore
+        return rescore(snapshot.vectors, queries, candidates, k)
+
+    def _merge_hits(self, distances: np.ndarray, indices: np.ndarray) -> List[Dict]:
+        best: Dict[int, float] = {}
+        for row_idx, row_scores in zip(indices, distances):
+            for idx, score in zip(row_idx, row_scores):
+                if idx < 0 or score < self.similarity_threshold:
+                    continue
+                idx, score = int(idx), float(score)
+                if idx not in best or score > best[idx]:
+                    best[idx] = score
+        return sorted(best.items(), key=lambda hit: hit[1], reverse=True)
+
+    def generate_excerpts(
+        self, relevant: List[Dict], snapshot: Optional[IndexSnapshot] = None
+    ) -> List[Tuple[str, Dict]]:
+        """Turn ranked hits into ``(text, metadata)`` excerpts, best first.
+
+        Hits on chunks of the same parent section are merged where they
+        overlap or touch, and replaced by the whole section once they cover
+        ``expand_ratio`` of it. Chunks without a parent are used as they are.
+        """
+        snapshot = snapshot or self.snapshot
+        metadata, parents = snapshot.metadata, snapshot.parents
+        # Excerpts, or the id of a section whose hits are collected in
+        # ``sections``, in the order of each one's best hit
+        ordered: List = []
+        sections: Dict[int, List[Dict]] = {}
         seen_texts = set()
-        for rank, (idx, score) in enumerate(relevant, start=1):
-            m = self.metadata[idx]
-            if (m["source"], m["chunk_id"]) not in seen_texts:
+        for idx, _ in relevant:
+            m = metadata[idx]
+            if m is None:  # Chunk removed by an incremental rebuild
+                continue
+            parent = m.get("parent") if parents is not None else None
+            if parent is not None:
+                if parent not in sections:
+                    sections[parent] = []
+                    ordered.append(parent)
+                sections[parent].append(m)
+            elif (m["source"], m["chunk_id"]) not in seen_texts:
                 seen_texts.add((m["source"], m["chunk_id"]))
-                excerpts.append((m["text"], m))
+                ordered.append((m["text"], m))
+
+        excerpts = []
+        for item in ordered:
+            if isinstance(item, int):
+                excerpts.extend(self._section_excerpts(parents[item], sections[item]))
+            else:
+                excerpts.append(item)
         return excerpts
 
+    def _section_excerpts(
+        self, section: Optional[Dict], hits: List[Dict]
+    ) -> List[Tuple[str, Dict]]:
+        if section is None:  # Section removed; fall back to the chunks themselves
+            return [(m["text"], m) for m in hits]
+        runs: List[List] = []  # [start, end, metadata of the run's first chunk]
+        for m in sorted(hits, key=lambda m: m["span"][0]):
+            start, end = m["span"]
+            if runs and start <= runs[-1][1]:
+                runs[-1][1] = max(runs[-1][1], end)
+            else:
+                runs.append([start, end, m])
+
+        text = section["text"]
+        if sum(end - start for start, end, _ in runs) >= self.expand_ratio * len(text):
+            return [(text, {**hits[0], "span": [0, len(text)]})]
+        return [
+            (text[start:end], {**m, "span": [start, end]}) for start, end, m in runs
+        ]
+
     def save_index(self):
         faiss.write_index(self.index, self.index_path)
-        with open(self.meta_path, "w", encoding="utf-8") as f:
-            json.dump(self.metadata, f)
+        if self.chunk_store_path:
+            write_chunk_store(self.chunk_store_path, list(self.metadata))
+        else:
+            with open(self.meta_path, "w", encoding="utf-8") as f:
+                json.dump(list(self.metadata), f)
+
+
+class SearchBatcher:
+    """Coalesce concurrent searches into one matrix ``index.search`` call.
+
+    Queries arriving within ``max_wait_ms`` of each other (up to
+    ``max_batch_size`` rows) are searched together in a worker thread, and
+    each caller gets back exactly what ``FAISSIndex.search_many`` would return.
+    """
+
+    def __init__(
+        self,
+        faiss_index: FAISSIndex,
+        max_batch_size: int = 64,
+        max_wait_ms: float = 2.0,
+    ):
+        self.faiss_index = faiss_index
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._pending: List[Tuple[np.ndarray, int, asyncio.Future, IndexSnapshot]] = []
+        self._pending_rows = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # The loop only holds weak references to tasks; keep running batches
+        # alive until they finish, or their callers could wait forever
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def search_many(
+        self,
+        query_embeddings: np.ndarray,
+        k: int = 5,
+        snapshot: Optional[IndexSnapshot] = None,
+    ) -> List[Dict]:
+        loop = asyncio.get_running_loop()
+        queries = np.ascontiguousarray(
+            query_embeddings.reshape(-1, self.faiss_index.embed_dim), dtype=np.float32
+        )
+        future = loop.create_future()
+        snapshot = snapshot or self.faiss_index.snapshot
+        self._pending.append((queries, k, future, snapshot))
+        self._pending_rows += len(queries)
+
+        if self._pending_rows >= self.max_batch_size or self.max_wait <= 0:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending, self._pending_rows = self._pending, [], 0
+
+        # A reload between two requests can leave a batch spanning snapshots
+        groups: Dict[int, List] = {}
+        for item in batch:
+            groups.setdefault(id(item[3]), []).append(item)
+        for group in groups.values():
+            task = asyncio.get_running_loop().create_task(self._run(group))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(
+        self, batch: List[Tuple[np.ndarray, int, asyncio.Future, IndexSnapshot]]
+    ):
+        snapshot = batch[0][3]
+        matrix = np.vstack([queries for queries, _, _, _ in batch])
+        k = max(k for _, k, _, _ in batch)
+        try:
+            distances, indices = await asyncio.to_thread(
+                self.faiss_index.search_snapshot, snapshot, matrix, k
+            )
+        except Exception as e:
+            for _, _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        row = 0
+        for queries, k_i, future, _ in batch:
+            rows = slice(row, row + len(queries))
+            row += len(queries)
+            if future.done():
+                continue  # Caller went away
+            future.set_result(
+                self.faiss_index._merge_hits(distances[rows, :k_i], indices[rows, :k_i])
+            )
@@ -1,47 +1,155 @@
-from typing import Any, Dict
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional
 import numpy as np
 
 from openai import AsyncOpenAI
 
+from app.models.cache import EmbeddingCache
+
 
 class LLM:
-    def __init__(self, api_key: str, base_url: str = "https://api.openai.com/v1"):
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = "https://api.openai.com/v1",
+        embed_model: str = "text-embedding-3-small",
+        embed_cache: Optional[EmbeddingCache] = None,
+    ):
         self.client = AsyncOpenAI(api_key=api_key, base_url=base_url)
+        self.embed_model = embed_model
+        self.embed_cache = embed_cache
+
+    async def warmup(self):
+        """Open a pooled API connection so the first request skips TCP/TLS setup."""
+        try:
+            await self.client.with_options(max_retries=0, timeout=10).models.list()
+        except Exception as e:
+            print(f"LLM warmup failed: {e}")
 
     async def embed(self, text: str) -> np.ndarray:
-        resp = await self.client.embeddings.create(
-            model="text-embedding-3-small", input=[text]
-        )
-        q_emb = np.array(resp.data[0].embedding, dtype=np.float32)
-        return q_emb / np.linalg.norm(q_emb)
+        return (await self.embed_many([text]))[0]
+
+    async def embed_many(self, texts: List[str]) -> np.ndarray:
+        """Embed several texts in a single API round-trip, one row per text.
+
+        Texts already in ``embed_cache`` are served from it; only the misses
+        are sent to the API.
+        """
+        embs: List[Optional[np.ndarray]] = [None] * len(texts)
+        if self.embed_cache is not None:
+            embs = await self.embed_cache.get_many(texts, self.embed_model)
+
+        missing = [i for i, emb in enumerate(embs) if emb is None]
+        if missing:
+            resp = await self.client.embeddings.create(
+                model=self.embed_model, input=[texts[i] for i in missing]
+            )
+            for i, d in zip(missing, sorted(resp.data, key=lambda d: d.index)):
+                emb = np.array(d.embedding, dtype=np.float32)
+                emb /= np.linalg.norm(emb)
+                embs[i] = emb
+                if self.embed_cache is not None:
+                    self.embed_cache.put(texts[i], self.embed_model, emb, wait=False)
+
+        return np.vstack(embs)  # type: ignore
+
+    def build_messages(self, prompt: str) -> List[Dict[str, str]]:
+        return [
+            {
+                "role": "system",
+                "content": (
+                    "You are an expert helpful and kind assistant. Follow these rules exactly:\n\n"
+                    "1. **Answer from provided excerpts only.**\n"
+                    "   - Do not use outside information.\n"
+                    "   - If you can't answer using only these excerpts, reply:\n"
+                    "     “I'm sorry, I don't have enough context to answer that question.”\n\n"
+                    "2. **Format your response as JSON** with two fields:\n"
+                    '   - `"answer"`: your full answer text.\n'
+                    '   - `"links"`: an array of all excerpts you cited.\n'
+                    '     Each item in `"links"` must include:\n'
+                    '     • `"url"`: the excerpt\'s identifier or link\n'
+                    '     • `"text"`: a brief description of what that excerpt says\n\n'
+                    "3. **Citing excerpts:**\n"
+                    "   - Cite every excerpt that supports any part of your answer.\n"
+                    "   - If different excerpts back different points, list them all.\n"
+                    "   - When roles are shown (e.g., “(@alice: Course TA)”), treat statements by authoritative roles as higher weight—but still only answer from the text provided."
+                ),
+            },
+            {"role": "user", "content": prompt},
+        ]
 
     async def generate_response(self, prompt: str, model: str = "gpt-4o-mini", response_format: Dict[str, Any] = None) -> Any:  # type: ignore
         response = await self.client.chat.completions.create(
             model=model,
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "You are an expert helpful and kind assistant. Follow these rules exactly:\n\n"
-                        "1. **Answer from provided excerpts only.**\n"
-                        "   - Do not use outside information.\n"
-                        "   - If you can't answer using only these excerpts, reply:\n"
-                        "     “I'm sorry, I don't have enough context to answer that question.”\n\n"
-                        "2. **Format your response as JSON** with two fields:\n"
-                        '   - `"answer"`: your full answer text.\n'
-                        '   - `"links"`: an array of all excerpts you cited.\n'
-                        '     Each item in `"links"` must include:\n'
-                        '     • `"url"`: the excerpt\'s identifier or link\n'
-                        '     • `"text"`: a brief description of what that excerpt says\n\n'
-                        "3. **Citing excerpts:**\n"
-                        "   - Cite every excerpt that supports any part of your answer.\n"
-                        "   - If different excerpts back different points, list them all.\n"
-                        "   - When roles are shown (e.g., “(@alice: Course TA)”), treat statements by authoritative roles as higher weight—but still only answer from the text provided."
-                    ),
-                },
-                {"role": "user", "content": prompt},
-            ],
+            messages=self.build_messages(prompt),  # type: ignore
             temperature=0.5,
             response_format=response_format,  # type: ignore
         )
         return response.choices[0].message
+
+    async def stream_response(self, prompt: str, model: str = "gpt-4o-mini", response_format: Dict[str, Any] = None) -> AsyncIterator[str]:  # type: ignore
+        """Yield content deltas of the completion as they arrive."""
+        stream = await self.client.chat.completions.create(
+            model=model,
+            messages=self.build_messages(prompt),  # type: ignore
+            temperature=0.5,
+            response_format=response_format,  # type: ignore
+            stream=True,
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+class AnswerStreamParser:
+    """Incrementally extract the ``answer`` string from streamed JSON output.
+
+    The response schema puts ``answer`` first, so its characters can be
+    forwarded to the client before the rest of the object (``links``) exists.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._in_answer = False
+        self._done = False
+
+    def feed(self, delta: str) -> str:
+        if self._done:
+            return ""
+        self._buffer += delta
+
+        if not self._in_answer:
+            key = self._buffer.find('"answer"')
+            if key < 0:
+                return ""
+            colon = self._buffer.find(":", key + len('"answer"'))
+            quote = self._buffer.find('"', colon + 1) if colon >= 0 else -1
+            if quote < 0:
+                return ""
+            self._in_answer = True
+            self._buffer = self._buffer[quote + 1 :]
+
+        out = []
+        i = 0
+        while i < len(self._buffer):
+            ch = self._buffer[i]
+            if ch == '"':
+                self._done = True
+                break
+            if ch == "\\":
+                # Hold back escapes until they are complete
+                escape = self._buffer[i + 1 : i + 4].lower()
+                end = i + 2
+                if escape[:1] == "u":
+                    end = i + 6
+                    if escape[1:2] == "d" and escape[2:3] in ("8", "9", "a", "b"):
+                        end += 6  # High surrogate; decode it together with its pair
+                if end > len(self._buffer):
+                    break
+                out.append(json.loads(f'"{self._buffer[i:end]}"'))
+                i = end
+                continue
+            out.append(ch)
+            i += 1
+        self._buffer = self._buffer[i:]
+        return "".join(out)
@@ -1,17 +1,253 @@
+import asyncio
 import base64
 import io
-from PIL import Image
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+from PIL import ExifTags, Image, ImageOps
 import pytesseract
 
 
+class OCRBusyError(RuntimeError):
+    """Raised when the OCR pool already has ``max_pending`` jobs queued."""
+
+
+class OCRTimeoutError(TimeoutError):
+    """Raised when a single OCR job runs longer than the configured timeout."""
+
+
+class OCRImageTooLargeError(ValueError):
+    """Raised when an image exceeds the byte or pixel limits."""
+
+
+class Preprocessing(NamedTuple):
+    """How images are prepared for tesseract; 0 disables a limit or step."""
+
+    max_pixels: int = 40_000_000  # Rejected above this, before decoding
+    max_width: int = 1800  # Wider images are downscaled
+    target_dpi: int = 300  # Images declaring a higher DPI are downscaled to it
+    binarize: bool = True
+    tile_height: int = 2000  # Taller images are OCR'd in tiles, in parallel
+
+
+# A grayscale tile as it crosses process boundaries: size and raw pixels
+Tile = Tuple[Tuple[int, int], bytes]
+
+
+def otsu_threshold(gray: np.ndarray) -> int:
+    """The gray level that best separates ``gray`` into two classes."""
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    omega = np.cumsum(hist) / gray.size
+    mu = np.cumsum(hist * np.arange(256)) / gray.size
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between = (mu[-1] * omega - mu) ** 2 / (omega * (1 - omega))
+    return int(np.argmax(np.nan_to_num(between)))
+
+
+def load_image(img_data: bytes, options: Preprocessing) -> np.ndarray:
+    """Decode an image into dark-on-light grayscale pixels sized for OCR."""
+    img = Image.open(io.BytesIO(img_data))
+    if options.max_pixels and img.width * img.height > options.max_pixels:
+        raise OCRImageTooLargeError(
+            f"Image is {img.width}x{img.height} pixels; "
+            f"the limit is {options.max_pixels} pixels"
+        )
+
+    # EXIF orientations 5-8 turn the image by 90 degrees, swapping its sides
+    rotated = img.getexif().get(ExifTags.Base.Orientation, 1) in (5, 6, 7, 8)
+    width, height = (img.height, img.width) if rotated else img.size
+    scale = 1.0
+    if options.max_width and width > options.max_width:
+        scale = options.max_width / width
+    dpi = img.info.get("dpi", (0, 0))[0]
+    if options.target_dpi and dpi > options.target_dpi:
+        scale = min(scale, options.target_dpi / dpi)
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    # JPEGs decode straight at (about) the target size
+    img.draft("L", size[::-1] if rotated else size)
+
+    img = ImageOps.exif_transpose(img)
+    if img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info:
+        # Transparent areas would turn black; put them on white instead
+        img = img.convert("RGBA")
+        img = Image.alpha_composite(Image.new("RGBA", img.size, "white"), img)
+    img = img.convert("L")
+    if img.size != size and scale < 1:
+        img = img.resize(size, Image.Resampling.LANCZOS)
+
+    pixels = np.asarray(img)
+    threshold = otsu_threshold(pixels)
+    if options.binarize:
+        pixels = np.where(pixels > threshold, 255, 0).astype(np.uint8)
+        threshold = 127
+    if np.count_nonzero(pixels > threshold) < pixels.size / 2:
+        # Mostly dark: a dark-mode screenshot. tesseract wants dark text on light
+        pixels = 255 - pixels
+    return pixels
+
+
+def split_tall(pixels: np.ndarray, tile_height: int) -> List[np.ndarray]:
+    """Cut a tall image into tiles of at most ``tile_height`` rows.
+
+    Tiles are about equally tall, and cuts go through the blank row nearest
+    to each target, so no line of text is split.
+    """
+    if not tile_height or len(pixels) <= tile_height:
+        return [pixels]
+    threshold = otsu_threshold(pixels)
+    blank = ~(pixels <= threshold).any(axis=1)
+    cuts = [0]
+    while len(pixels) - cuts[-1] > tile_height:
+        remaining = len(pixels) - cuts[-1]
+        step = -(-remaining // -(-remaining // tile_height))  # Even split
+        lo = cuts[-1] + step - step // 4
+        hi = min(cuts[-1] + tile_height, cuts[-1] + step + step // 4)
+        candidates = lo + np.flatnonzero(blank[lo:hi])
+        target = cuts[-1] + step
+        cuts.append(
+            int(candidates[np.argmin(np.abs(candidates - target))])
+            if len(candidates)
+            else target
+        )
+    cuts.append(len(pixels))
+    return [pixels[a:b] for a, b in zip(cuts[:-1], cuts[1:])]
+
+
+def _prepare_tiles(
+    image_data: Union[str, bytes], options: Preprocessing = Preprocessing()
+) -> List[Tile]:
+    # Runs inside a pool worker, so it has to stay a picklable module-level function.
+    # Raw bytes are accepted too: they pickle smaller than the base64 text.
+    img_data = (
+        base64.b64decode(image_data) if isinstance(image_data, str) else image_data
+    )
+    pixels = load_image(img_data, options)
+    return [
+        ((tile.shape[1], tile.shape[0]), tile.tobytes())
+        for tile in split_tall(pixels, options.tile_height)
+    ]
+
+
+def _ocr_tile(tile: Tile, timeout: float = 0) -> str:
+    size, data = tile
+    img = Image.frombytes("L", size, data)
+    return pytesseract.image_to_string(img, timeout=timeout).strip()
+
+
+def _run_ocr(
+    image_data: Union[str, bytes],
+    timeout: float = 0,
+    options: Preprocessing = Preprocessing(),
+) -> str:
+    tiles = _prepare_tiles(image_data, options)
+    return "\n".join(_ocr_tile(tile, timeout) for tile in tiles)
+
+
 class OCR:
-    def __init__(self):
-        pass
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        max_pending: int = 32,
+        timeout: float = 30.0,
+        max_bytes: int = 10 * 1024 * 1024,
+        preprocessing: Preprocessing = Preprocessing(),
+    ):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.preprocessing = preprocessing
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # Created lazily so importing the module never forks worker processes.
+        # By then the server runs threads (to_thread, faiss/OpenMP), which a
+        # plain fork() would copy mid-lock; forkserver starts workers from a
+        # clean single-threaded process instead.
+        if self._pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context(
+                "forkserver" if "forkserver" in methods else "spawn"
+            )
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=context
+            )
+        return self._pool
 
-    def extract_text(self, image_data: str) -> str:
+    def _check_size(self, image_data: Union[str, bytes]):
+        # Base64 text decodes to about 3/4 of its length
+        size = (
+            len(image_data) * 3 // 4 if isinstance(image_data, str) else len(image_data)
+        )
+        if self.max_bytes and size > self.max_bytes:
+            raise OCRImageTooLargeError(
+                f"Image is {size} bytes; the limit is {self.max_bytes} bytes"
+            )
+
+    def extract_text(self, image_data: Union[str, bytes]) -> str:
+        self._check_size(image_data)
+        try:
+            return _run_ocr(image_data, self.timeout, self.preprocessing)
+        except OCRImageTooLargeError:
+            raise
+        except Exception as e:
+            raise ValueError(f"OCR decoding error: {e}")
+
+    async def _extract(self, image_data: Union[str, bytes]) -> str:
+        loop = asyncio.get_running_loop()
+        pool = self._get_pool()
+        tiles = await loop.run_in_executor(
+            pool, _prepare_tiles, image_data, self.preprocessing
+        )
+        # Tiles of a tall screenshot are recognized side by side
+        texts = await asyncio.gather(
+            *(loop.run_in_executor(pool, _ocr_tile, t, self.timeout) for t in tiles)
+        )
+        return "\n".join(texts)
+
+    async def extract_text_async(self, image_data: Union[str, bytes]) -> str:
+        """Preprocess and OCR an image in the process pool without blocking."""
+        self._check_size(image_data)
+        if self._pending >= self.max_pending:
+            raise OCRBusyError(
+                f"OCR queue is full ({self._pending}/{self.max_pending} jobs pending)"
+            )
+
+        self._pending += 1
         try:
-            img_data = base64.b64decode(image_data)
-            img = Image.open(io.BytesIO(img_data))
-            return pytesseract.image_to_string(img)
+            # tesseract enforces the timeout inside the worker as well; the small
+            # grace period covers decoding and process hand-off.
+            return await asyncio.wait_for(
+                self._extract(image_data), timeout=self.timeout + 5
+            )
+        except BrokenProcessPool as e:
+            # A crashed worker poisons the whole pool; start a fresh one next time
+            self._pool = None
+            raise ValueError(f"OCR decoding error: {e}")
+        except asyncio.TimeoutError:
+            raise OCRTimeoutError(f"OCR timed out after {self.timeout}s")
+        except OCRImageTooLargeError:
+            raise
+        except RuntimeError as e:
+            # pytesseract signals its own timeout with RuntimeError
+            if "timeout" in str(e).lower():
+                raise OCRTimeoutError(f"OCR timed out after {self.timeout}s")
+            raise ValueError(f"OCR decoding error: {e}")
         except Exception as e:
             raise ValueError(f"OCR decoding error: {e}")
+        finally:
+            self._pending -= 1
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
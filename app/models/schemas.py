@@ -1,5 +1,5 @@
 from typing import List, Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class ChatRequest(BaseModel):
@@ -15,3 +15,9 @@ class Link(BaseModel):
 class ChatResponse(BaseModel):
     answer: str
     links: List[Link]
+
+
+class SearchParams(BaseModel):
+    # Bounded so a bad request can't make every search arbitrarily slow
+    nprobe: Optional[int] = Field(None, ge=1, le=65536)
+    ef_search: Optional[int] = Field(None, ge=1, le=4096)
@@ -0,0 +1,188 @@
+"""Local stand-in for the OpenAI embeddings and chat completions endpoints.
+
+Embeddings are deterministic bag-of-words vectors: every token maps to a fixed
+pseudo-random unit vector and a text embeds to the normalized sum of its
+tokens, so texts sharing words are close, just like real embeddings are for
+the benchmark's purposes. Chat completions answer after a configurable delay
+with a JSON body matching ``Config.RESPONSE_FORMAT``.
+
+Usage:
+    python -m benchmarks.fake_openai [--port 8001] [--latency-ms 300]
+
+Then point the app at it with ``OPENAI_BASE_URL=http://127.0.0.1:8001/v1``.
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import re
+import time
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+EMBED_DIM = 1536
+TOKEN_RE = re.compile(r"\w+")
+
+
+@lru_cache(maxsize=65536)
+def token_vector(token: str, dim: int = EMBED_DIM) -> np.ndarray:
+    seed = int.from_bytes(hashlib.sha256(token.encode("utf-8")).digest()[:8], "little")
+    vec = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vec / np.linalg.norm(vec)
+
+
+def fake_embedding(text: str, dim: int = EMBED_DIM) -> np.ndarray:
+    """Deterministic unit vector for ``text``; shared words mean high similarity."""
+    tokens = TOKEN_RE.findall(text.lower()) or [""]
+    vec = np.sum([token_vector(t, dim) for t in tokens], axis=0)
+    return (vec / np.linalg.norm(vec)).astype(np.float32)
+
+
+class EmbeddingRequest(BaseModel):
+    model: str
+    input: Union[str, List[str]]
+    dimensions: Optional[int] = None
+    encoding_format: Optional[str] = None
+
+
+class ChatRequest(BaseModel):
+    model: str
+    messages: List[Dict[str, Any]]
+    stream: bool = False
+
+    model_config = {"extra": "allow"}
+
+
+def create_app(latency_ms: float = 300.0, stream_chunks: int = 20) -> FastAPI:
+    app = FastAPI(title="Fake OpenAI")
+    app.state.requests = {"embeddings": 0, "chat": 0}
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: EmbeddingRequest):
+        app.state.requests["embeddings"] += 1
+        texts = [request.input] if isinstance(request.input, str) else request.input
+        data = []
+        for i, text in enumerate(texts):
+            vec = fake_embedding(text, request.dimensions or EMBED_DIM)
+            if request.encoding_format == "base64":
+                embedding: Any = base64.b64encode(vec.tobytes()).decode("ascii")
+            else:
+                embedding = vec.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        tokens = sum(len(TOKEN_RE.findall(t)) for t in texts)
+        return {
+            "object": "list",
+            "data": data,
+            "model": request.model,
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: ChatRequest):
+        app.state.requests["chat"] += 1
+        content = json.dumps(
+            {
+                "answer": "This is a canned benchmark answer. " * 8,
+                "links": [{"url": "https://example.com/bench", "text": "Benchmark"}],
+            }
+        )
+        base = {
+            "id": "chatcmpl-bench",
+            "created": int(time.time()),
+            "model": request.model,
+        }
+
+        if not request.stream:
+            await asyncio.sleep(latency_ms / 1000)
+            return {
+                **base,
+                "object": "chat.completion",
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {
+                            "role": "assistant",
+                            "content": content,
+                            "refusal": None,
+                        },
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                    "total_tokens": 0,
+                },
+            }
+
+        async def chunks():
+            # Spread the same total latency over the streamed pieces
+            step = max(1, len(content) // stream_chunks)
+            for start in range(0, len(content), step):
+                await asyncio.sleep(latency_ms / 1000 / stream_chunks)
+                chunk = {
+                    **base,
+                    "object": "chat.completion.chunk",
+                    "choices": [
+                        {
+                            "index": 0,
+                            "delta": {"content": content[start : start + step]},
+                            "finish_reason": None,
+                        }
+                    ],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    @app.get("/v1/models")
+    async def models():
+        # Listed by the app's warmup to open a pooled connection
+        return {
+            "object": "list",
+            "data": [{"id": "gpt-4o-mini", "object": "model", "owned_by": "bench"}],
+        }
+
+    @app.get("/v1/stats")
+    async def stats():
+        return app.state.requests
+
+    return app
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Run a local fake OpenAI API server.")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8001)
+    p.add_argument(
+        "--latency-ms",
+        type=float,
+        default=300.0,
+        help="Time a chat completion takes (default: 300)",
+    )
+    p.add_argument(
+        "--stream-chunks",
+        type=int,
+        default=20,
+        help="Pieces a streamed completion is split into (default: 20)",
+    )
+    return p.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    uvicorn.run(
+        create_app(args.latency_ms, args.stream_chunks),
+        host=args.host,
+        port=args.port,
+        log_level="warning",
+    )
@@ -0,0 +1,270 @@
+"""Closed-loop load driver for the Virtual TA API.
+
+By default it starts the fake OpenAI server and the app (under uvicorn, in
+the directory holding the synthetic ``model/``) on local ports, then sends
+``--requests`` questions from ``--concurrency`` concurrent clients, once with
+text only and once with an attached screenshot, and reports throughput and
+latency percentiles. ``--url`` targets an already running app instead.
+
+Usage:
+    python -m benchmarks.make_index --sizes 10000
+    python -m benchmarks.load --data bench-data/10000 [--requests 500] [--concurrency 32]
+"""
+
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+import httpx
+import numpy as np
+from PIL import Image, ImageDraw
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_image(text: str) -> str:
+    """A base64 PNG 'screenshot' of ``text``, for the OCR path."""
+    img = Image.new("RGB", (1000, 200), "white")
+    ImageDraw.Draw(img).multiline_text((20, 20), text, fill="black")
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+def make_questions(topics: List[List[str]], n: int, seed: int = 0) -> List[str]:
+    # Unique questions, so the embedding and answer caches don't hide the work
+    rng = random.Random(seed)
+    return [
+        f"What does {' '.join(rng.choice(topics))} mean? (question {i})"
+        for i in range(n)
+    ]
+
+
+async def run_load(
+    url: str,
+    questions: List[str],
+    concurrency: int,
+    image: Optional[str] = None,
+    stream: bool = False,
+) -> Dict:
+    endpoint = f"{url}/api/stream" if stream else f"{url}/api"
+    latencies: List[float] = []
+    first_bytes: List[float] = []
+    errors = 0
+    queue = iter(questions)
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal errors
+        for question in queue:
+            body = {"question": question}
+            if image is not None:
+                body["image"] = image
+            start = time.perf_counter()
+            try:
+                async with client.stream("POST", endpoint, json=body) as resp:
+                    first = None
+                    async for _ in resp.aiter_bytes():
+                        if first is None:
+                            first = time.perf_counter() - start
+                    if resp.status_code != 200:
+                        errors += 1
+                        continue
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+            first_bytes.append(first or latencies[-1])
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    result = {
+        "requests": len(questions),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 2),
+    }
+    for name, values in (("latency_ms", latencies), ("first_byte_ms", first_bytes)):
+        if values:
+            p50, p95, p99 = np.percentile(np.array(values) * 1000, [50, 95, 99])
+            result[name] = {
+                "p50": round(p50, 1),
+                "p95": round(p95, 1),
+                "p99": round(p99, 1),
+            }
+    return result
+
+
+def wait_for(url: str, proc: subprocess.Popen, timeout: float = 120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"{' '.join(proc.args)} exited with {proc.returncode}")  # type: ignore
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise SystemExit(f"Timed out waiting for {url}")
+
+
+def spawn(args) -> List[subprocess.Popen]:
+    """Start the fake OpenAI server and the app; returns both processes."""
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join(
+            filter(None, [REPO_ROOT, os.getenv("PYTHONPATH")])
+        ),
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.openai_port}/v1",
+        "INDEX_WATCH_INTERVAL": "0",
+    }
+    if args.no_cache:
+        env.update({"EMBED_CACHE_SIZE": "0", "SEMANTIC_CACHE_SIZE": "0"})
+
+    fake = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.fake_openai",
+            "--port",
+            str(args.openai_port),
+            "--latency-ms",
+            str(args.latency_ms),
+        ],
+        cwd=REPO_ROOT,
+        env=env,
+    )
+    app = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app.main:app",
+            "--port",
+            str(args.port),
+            "--workers",
+            str(args.workers),
+            "--log-level",
+            "warning",
+        ],
+        cwd=args.data,
+        env=env,
+    )
+    procs = [fake, app]
+    try:
+        wait_for(f"http://127.0.0.1:{args.openai_port}/v1/stats", fake)
+        wait_for(f"http://127.0.0.1:{args.port}/health", app)
+    except BaseException:
+        for proc in procs:
+            proc.terminate()
+        raise
+    return procs
+
+
+def print_table(results: Dict[str, Dict]):
+    print(
+        f"{'mode':<12}{'reqs':>7}{'errors':>8}{'rps':>9}"
+        f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    )
+    for mode, r in results.items():
+        lat = r.get("latency_ms", {})
+        print(
+            f"{mode:<12}{r['requests']:>7}{r['errors']:>8}{r['rps']:>9}"
+            f"{lat.get('p50', '-'):>10}{lat.get('p95', '-'):>10}{lat.get('p99', '-'):>10}"
+        )
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Load test the Virtual TA API offline.")
+    p.add_argument(
+        "--data",
+        required=True,
+        help="Directory from benchmarks.make_index (holds model/ and topics.json)",
+    )
+    p.add_argument("--url", help="Benchmark a running app instead of starting one")
+    p.add_argument("--requests", type=int, default=200, help="Requests per mode")
+    p.add_argument("--concurrency", type=int, default=16, help="Concurrent clients")
+    p.add_argument(
+        "--modes",
+        nargs="+",
+        choices=["text", "image"],
+        default=["text", "image"],
+        help="Run with text-only questions, with a screenshot attached, or both",
+    )
+    p.add_argument(
+        "--stream", action="store_true", help="Use POST /api/stream instead of /api"
+    )
+    p.add_argument("--warmup", type=int, default=10, help="Unmeasured requests first")
+    p.add_argument("--port", type=int, default=8100, help="Port for the spawned app")
+    p.add_argument("--openai-port", type=int, default=8101)
+    p.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    p.add_argument(
+        "--latency-ms", type=float, default=300.0, help="Fake chat completion latency"
+    )
+    p.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Disable the embedding and semantic caches in the spawned app",
+    )
+    p.add_argument("--output", help="Also write the results as JSON to this file")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    with open(os.path.join(args.data, "topics.json")) as f:
+        topics = json.load(f)
+
+    procs = [] if args.url else spawn(args)
+    url = (args.url or f"http://127.0.0.1:{args.port}").rstrip("/")
+    try:
+        results = {}
+        for mode in args.modes:
+            image = (
+                make_image("Error: ModuleNotFoundError\nin GA4 Q7")
+                if mode == "image"
+                else None
+            )
+            questions = make_questions(
+                topics, args.warmup + args.requests, seed=len(results)
+            )
+            if args.warmup:
+                asyncio.run(
+                    run_load(
+                        url,
+                        questions[: args.warmup],
+                        args.concurrency,
+                        image,
+                        args.stream,
+                    )
+                )
+            results[mode] = asyncio.run(
+                run_load(
+                    url, questions[args.warmup :], args.concurrency, image, args.stream
+                )
+            )
+    finally:
+        for proc in procs:
+            proc.terminate()
+            proc.wait()
+
+    print_table(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
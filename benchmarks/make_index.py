@@ -0,0 +1,116 @@
+"""Generate synthetic FAISS indexes, chunk stores and BM25 indexes for benchmarks.
+
+Chunks are grouped into topics: each chunk repeats its topic's keywords among
+random filler words, and is embedded with the fake server's embedding so
+that a question naming a topic's keywords retrieves that topic's chunks.
+Each corpus size gets its own directory laid out like the app's working
+directory, plus the topic keywords the load driver asks about:
+
+    <out>/<n>/model/virtual-ta.faiss, chunks.bin, metadata.json, bm25.npz
+    <out>/<n>/topics.json
+
+Usage:
+    python -m benchmarks.make_index [--sizes 1000 10000 100000] [--out bench-data]
+"""
+
+import argparse
+import json
+import os
+
+import faiss
+import numpy as np
+
+from app.core.config import Config
+from app.models.bm25 import write_bm25_index
+from app.models.chunk_store import write_chunk_store
+from app.models.faiss_index import INDEX_TYPES, create_index
+from benchmarks.fake_openai import fake_embedding, token_vector
+
+CHUNKS_PER_TOPIC = 10
+KEYWORDS_PER_TOPIC = 5
+KEYWORD_REPEATS = 20
+
+
+def make_corpus(n: int, chunk_words: int, vocab_size: int, seed: int = 0):
+    """Return chunk records, their embeddings and each topic's keywords."""
+    rng = np.random.default_rng(seed)
+    n_topics = max(1, n // CHUNKS_PER_TOPIC)
+    topics = [
+        [f"topic{t}k{j}" for j in range(KEYWORDS_PER_TOPIC)] for t in range(n_topics)
+    ]
+    filler = [f"word{i}" for i in range(vocab_size)]
+    filler_vecs = np.vstack([token_vector(w) for w in filler])
+    # Zipf-like filler frequencies, as in natural text
+    weights = 1.0 / np.arange(1, vocab_size + 1)
+    weights /= weights.sum()
+
+    records, embeddings = [], np.zeros((n, Config.EMBED_DIM), dtype=np.float32)
+    n_filler = max(0, chunk_words - KEYWORDS_PER_TOPIC * KEYWORD_REPEATS)
+    for i in range(n):
+        topic = i % n_topics
+        ids = rng.choice(vocab_size, size=n_filler, p=weights)
+        words = [filler[j] for j in ids] + topics[topic] * KEYWORD_REPEATS
+        rng.shuffle(words)
+        text = " ".join(words)
+        records.append(
+            {
+                "text": text,
+                "source": f"https://example.com/topic/{topic}",
+                "chunk_id": i // n_topics,
+                "path": f"data/synthetic/topic_{topic}.md",
+            }
+        )
+        # Same as fake_embedding(text), without re-tokenizing the text
+        vec = filler_vecs[ids].sum(axis=0) + KEYWORD_REPEATS * np.sum(
+            [token_vector(k) for k in topics[topic]], axis=0
+        )
+        embeddings[i] = vec / np.linalg.norm(vec)
+    return records, embeddings, topics
+
+
+def build(
+    out_dir: str, n: int, index_type: str, chunk_words: int, vocab_size: int
+) -> None:
+    model_dir = os.path.join(out_dir, str(n), "model")
+    os.makedirs(model_dir, exist_ok=True)
+    records, embeddings, topics = make_corpus(n, chunk_words, vocab_size)
+    assert np.allclose(embeddings[0], fake_embedding(records[0]["text"]), atol=1e-4)
+
+    index = create_index(Config.EMBED_DIM, index_type, nlist=max(1, min(1024, n // 39)))
+    if not index.is_trained:
+        index.train(embeddings)  # type: ignore
+    index.add(embeddings)  # type: ignore
+
+    def model_path(config_path: str) -> str:
+        return os.path.join(model_dir, os.path.basename(config_path))
+
+    faiss.write_index(index, model_path(Config.FAISS_INDEX_PATH))
+    write_chunk_store(model_path(Config.CHUNK_STORE_PATH), records)
+    with open(model_path(Config.METADATA_PATH), "w", encoding="utf-8") as f:
+        json.dump(records, f)
+    write_bm25_index(model_path(Config.BM25_INDEX_PATH), records)
+    with open(os.path.join(out_dir, str(n), "topics.json"), "w") as f:
+        json.dump(topics, f)
+    print(f"Wrote {n} chunks ({len(topics)} topics, {index_type}) to {model_dir}")
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Generate synthetic benchmark indexes.")
+    p.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1000, 10000, 100000],
+        help="Corpus sizes in chunks (default: 1000 10000 100000)",
+    )
+    p.add_argument("--out", default="bench-data", help="Output directory")
+    p.add_argument("--index-type", choices=INDEX_TYPES, default="flat")
+    p.add_argument("--chunk-words", type=int, default=300, help="Words per chunk")
+    p.add_argument("--vocab-size", type=int, default=20000, help="Filler vocabulary")
+    return p.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    for n in args.sizes:
+        build(args.out, n, args.index_type, args.chunk_words, args.vocab_size)
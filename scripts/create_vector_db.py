@@ -1,10 +1,18 @@
 #!/usr/bin/env python3
+import argparse
+import glob
+import hashlib
 import os
+import random
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 import faiss
 import json
 import numpy as np
-from typing import List, Dict
+from typing import Deque, Iterator, List, Dict, Optional, Tuple
 from bs4 import BeautifulSoup
 import markdown as md
 from openai import OpenAI
@@ -12,6 +20,12 @@ from dotenv import load_dotenv
 import openai
 import tiktoken
 
+# make the app package importable when run as scripts/create_vector_db.py, so
+# the files the server memory-maps are written by the same (atomic) code
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.models.bm25 import write_bm25_index  # noqa: E402
+from app.models.chunk_store import ChunkStore, write_chunk_store  # noqa: E402
+
 load_dotenv()
 
 # CONFIGURATION
@@ -20,13 +34,37 @@ OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
 
 # Embedding & FAISS parameters
 EMBED_DIM = 1536
-BATCH_SIZE = 16  # embed in batches for efficiency
+BATCH_SIZE = 256  # max inputs per embeddings request
+BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "100000"))  # max tokens per request
+CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))  # requests in flight
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS") or os.cpu_count() or 1)  # processes
+MAX_RETRIES = 6  # on rate limits and transient API errors
 CHUNK_SIZE = 300  # approx tokens per chunk
 CHUNK_OVERLAP = 50
+PARENT_SIZE = 1500  # approx tokens per parent section a chunk can expand to
+
+# FAISS index type: flat, ivf, hnsw or ivfpq (overridable with --index-type)
+INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat")
+NLIST = int(os.getenv("FAISS_NLIST", "1024"))  # IVF cells
+HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("FAISS_HNSW_EF_CONSTRUCTION", "200"))
+PQ_M = int(os.getenv("FAISS_PQ_M", "64"))  # PQ sub-quantizers (must divide EMBED_DIM)
+PQ_NBITS = int(os.getenv("FAISS_PQ_NBITS", "8"))
+
+# output paths
+INDEX_PATH = "model/virtual-ta.faiss"
+CHUNK_STORE_PATH = "model/chunks.bin"
+METADATA_PATH = "model/metadata.json"
+PARENT_STORE_PATH = "model/parents.bin"  # sections the chunks were cut from
+BM25_PATH = "model/bm25.npz"  # keyword index over the same chunks
+VECTORS_PATH = "model/vectors.npy"  # float32 rows for re-scoring quantized hits
+MANIFEST_PATH = "model/manifest.json"  # file path -> content hash + vector ids
+BUILD_MARKER_PATH = "model/build.json"  # written last; servers reload when it changes
 
-# initialize FAISS
-index = faiss.IndexFlatIP(EMBED_DIM)
-metadata: List[Dict] = []
+# embeddings are collected first, since IVF indexes must be trained on them
+vectors: List[np.ndarray] = []
+metadata: List[Optional[Dict]] = []  # None marks a removed chunk
+parents: List[Optional[Dict]] = []  # chunk metadata points here by "parent"
 
 client = OpenAI(
     api_key=OPENAI_API_KEY,
@@ -53,6 +91,39 @@ def chunk_by_tokens(text: str, max_tokens: int, overlap: int) -> List[str]:
     return chunks
 
 
+Section = Tuple[str, List[Tuple[str, int, Tuple[int, int]]]]
+
+
+def chunk_hierarchy(
+    text: str, parent_tokens: int, max_tokens: int, overlap: int
+) -> List[Section]:
+    """Split text into parent sections, and each section into small chunks.
+
+    Returns ``(section_text, chunks)`` pairs, where each chunk is a
+    ``(text, n_tokens, (start, end))`` triple and ``start``/``end`` are
+    character offsets into its section. Chunks never cross sections.
+    """
+    # replace newlines so they count as single tokens
+    text = text.replace("\n", " ")
+    tokens = ENC.encode(text)
+    sections = []
+    for section_start in range(0, len(tokens), parent_tokens):
+        section_toks = tokens[section_start : section_start + parent_tokens]
+        section, offsets = ENC.decode_with_offsets(section_toks)
+        offsets.append(len(section))
+        chunks = []
+        start = 0
+        while True:
+            end = min(start + max_tokens, len(section_toks))
+            span = (offsets[start], offsets[end])
+            chunks.append((section[span[0] : span[1]], end - start, span))
+            if end == len(section_toks):
+                break
+            start += max_tokens - overlap
+        sections.append((section, chunks))
+    return sections
+
+
 def chunk_text(text: str, size: int, overlap: int) -> List[str]:
     words = text.split()
     chunks = []
@@ -65,14 +136,36 @@ def chunk_text(text: str, size: int, overlap: int) -> List[str]:
     return chunks
 
 
+def embed_texts(texts: List[str]) -> np.ndarray:
+    """Embed texts in one request, retrying transient errors with jittered backoff."""
+    texts = [t.replace("\n", " ") for t in texts]
+    for attempt in range(MAX_RETRIES):
+        try:
+            resp = client.embeddings.create(
+                model="text-embedding-3-small", input=texts, dimensions=EMBED_DIM
+            )
+            break
+        except (
+            openai.RateLimitError,
+            openai.APIConnectionError,
+            openai.APITimeoutError,
+            openai.InternalServerError,
+        ) as e:
+            if attempt == MAX_RETRIES - 1:
+                raise
+            delay = min(60, 2**attempt) * random.uniform(0.5, 1.0)
+            print(
+                f"Embedding request failed ({e.__class__.__name__}); retrying in {delay:.1f}s"
+            )
+            time.sleep(delay)
+
+    data = sorted(resp.data, key=lambda d: d.index)
+    embeddings = np.array([d.embedding for d in data], dtype=np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
 def embed_text(text: str) -> list:
-    text = text.replace("\n", " ")
-    resp = client.embeddings.create(
-        model="text-embedding-3-small", input=[text], dimensions=EMBED_DIM
-    )
-    embedding = np.array(resp.data[0].embedding, dtype=np.float32)
-    normalized_embedding = embedding / np.linalg.norm(embedding)
-    return normalized_embedding.tolist()
+    return embed_texts([text])[0].tolist()
 
 
 def safe_embed(text):
@@ -88,6 +181,17 @@ def safe_embed(text):
         raise
 
 
+def embed_batch(texts: List[str]) -> np.ndarray:
+    try:
+        return embed_texts(texts)
+    except openai.BadRequestError as e:
+        if "maximum context length" not in str(e):
+            raise
+        # Some input is too long: embed one by one so only that one gets split
+        embeddings = np.array([safe_embed(t) for t in texts], dtype=np.float32)
+        return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
 def load_file(path: str) -> str:
     ext = os.path.splitext(path)[1].lower()
     raw = open(path, encoding="utf-8").read()
@@ -119,51 +223,475 @@ def get_source(file: str) -> str:
     return file
 
 
-def ingest_dir(root_dir: str):
-    batch_texts, batch_meta = [], []
+def list_files(root_dir: str) -> List[str]:
+    paths = []
     for dirpath, _, files in os.walk(root_dir):
         for fname in files:
-            if not fname.lower().endswith((".txt", ".html", ".md")):
-                continue
-
-            full = os.path.join(dirpath, fname)
-            text = load_file(full)
-            print(f"Loaded {full} ({len(text)} chars): {len(text.split())} words)")
-            # chunks = chunk_text(text, CHUNK_SIZE, CHUNK_OVERLAP)
-            # now split by tokens, not words:
-            # use e.g. 8000 token window, 200 token overlap
-            chunks = chunk_by_tokens(text, max_tokens=8000, overlap=200)
-            for idx, chunk in enumerate(chunks):
-                meta = {"source": get_source(full), "chunk_id": idx}
-                batch_texts.append(chunk)
-                batch_meta.append(meta)
-                # when batch full, embed & index
-                if len(batch_texts) >= BATCH_SIZE:
-                    index_batch(batch_texts, batch_meta)
-                    batch_texts, batch_meta = [], []
-
-    # final batch
-    if batch_texts:
-        index_batch(batch_texts, batch_meta)
-
-
-def index_batch(texts: List[str], metas: List[Dict]):
-    # get embeddings in one call
-    embs = [embed_text(t) for t in texts]
-    arr = np.array(embs, dtype=np.float32)
-    index.add(arr)  # type: ignore
+            if fname.lower().endswith((".txt", ".html", ".md")):
+                paths.append(os.path.join(dirpath, fname))
+    return sorted(paths)
+
+
+def load_records(path: str) -> Dict[str, Dict]:
+    """Read pre-rendered documents, one ``{"path", "source", "text"}`` per line.
+
+    ``path`` stands in for a file under data/ (manifest key and chunk metadata);
+    a record replaces the file of the same path, if any. ``-`` reads stdin.
+    """
+    records = {}
+    fd = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    with fd:
+        for line in fd:
+            if line.strip():
+                record = json.loads(line)
+                records[os.path.normpath(record["path"])] = record
+    return records
+
+
+def ingest_dir(root_dir: str, workers: int = PARSE_WORKERS):
+    ingest_files(list_files(root_dir), workers)
+
+
+ParsedFile = Tuple[str, str, int, int, List[Section]]
+
+
+def parse_file(path: str, source: str, text: Optional[str] = None) -> ParsedFile:
+    """Load and chunk one file (or given text); runs in a worker process."""
+    if text is None:
+        text = load_file(path)
+    # small chunks are embedded and retrieved; the server expands hits to
+    # their parent section only when several of them cover most of it
+    sections = chunk_hierarchy(text, PARENT_SIZE, CHUNK_SIZE, CHUNK_OVERLAP)
+    return path, source, len(text), len(text.split()), sections
+
+
+def iter_parsed_files(
+    paths: List[str], workers: int, records: Optional[Dict[str, Dict]] = None
+) -> Iterator[ParsedFile]:
+    """Parse files across a process pool, yielding results in order as they finish.
+
+    At most a few files per worker are in flight, so parsed chunks stream into
+    the embedding stage instead of piling up in memory.
+    """
+    records = records or {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # resolve every file's source once, up front
+        files = [p for p in paths if p not in records]
+        sources = dict(zip(files, pool.map(get_source, files, chunksize=64)))
+        in_flight: Deque[Future] = deque()
+        for path in paths:
+            record = records.get(path)
+            if record is None:
+                future = pool.submit(parse_file, path, sources[path])
+            else:
+                source = record.get("source") or path
+                future = pool.submit(parse_file, path, source, record["text"])
+            in_flight.append(future)
+            if len(in_flight) >= workers * 4:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def ingest_files(
+    paths: List[str],
+    workers: int = PARSE_WORKERS,
+    records: Optional[Dict[str, Dict]] = None,
+):
+    batch_texts, batch_meta, batch_tokens = [], [], 0
+    pending: List[Tuple[Future, List[str], List[Dict]]] = []
+
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+
+        def submit_batch():
+            nonlocal batch_texts, batch_meta, batch_tokens
+            future = executor.submit(embed_batch, batch_texts)
+            pending.append((future, batch_texts, batch_meta))
+            batch_texts, batch_meta, batch_tokens = [], [], 0
+            # keep a bounded number of requests queued; index results in order
+            while len(pending) > CONCURRENCY * 2:
+                index_batch(*drain(pending.pop(0)))
+
+        for full, source, n_chars, n_words, sections in iter_parsed_files(
+            paths, workers, records
+        ):
+            print(f"Loaded {full} ({n_chars} chars): {n_words} words)")
+            idx = 0
+            for section, chunks in sections:
+                parent = len(parents)
+                parents.append({"text": section, "source": source, "path": full})
+                for chunk, tokens, span in chunks:
+                    # when the request would get too large, send it off
+                    if batch_texts and (
+                        len(batch_texts) >= BATCH_SIZE
+                        or batch_tokens + tokens > BATCH_TOKENS
+                    ):
+                        submit_batch()
+                    meta = {
+                        "source": source,
+                        "chunk_id": idx,
+                        "path": full,
+                        "parent": parent,
+                        "span": list(span),
+                    }
+                    batch_texts.append(chunk)
+                    batch_meta.append(meta)
+                    batch_tokens += tokens
+                    idx += 1
+
+        # final batch
+        if batch_texts:
+            submit_batch()
+        for item in pending:
+            index_batch(*drain(item))
+
+
+def drain(item: Tuple[Future, List[str], List[Dict]]):
+    future, texts, metas = item
+    return texts, metas, future.result()
+
+
+def index_batch(texts: List[str], metas: List[Dict], embs: np.ndarray):
+    vectors.append(embs)
     metadata.extend([{"text": t, **m} for t, m in zip(texts, metas)])
-    print(f"Indexed {len(texts)} chunks; total is now {index.ntotal}")
+    print(f"Embedded {len(texts)} chunks; total is now {len(metadata)}")
+
+
+def build_index(
+    embeddings: np.ndarray,
+    index_type: str = "flat",
+    nlist: int = NLIST,
+    hnsw_m: int = HNSW_M,
+    hnsw_ef_construction: int = HNSW_EF_CONSTRUCTION,
+    pq_m: int = PQ_M,
+    pq_nbits: int = PQ_NBITS,
+) -> faiss.Index:
+    n, dim = embeddings.shape
+    if index_type in ("ivf", "ivfpq"):
+        # faiss wants ~39 training points per cell; shrink nlist for small corpora
+        max_nlist = max(1, n // 39)
+        if nlist > max_nlist:
+            print(f"Reducing nlist from {nlist} to {max_nlist} for {n} vectors")
+            nlist = max_nlist
+        if index_type == "ivfpq" and n < 2**pq_nbits:
+            print(f"Only {n} vectors, too few to train PQ; using ivf instead")
+            index_type = "ivf"
+
+    if index_type == "flat":
+        # id-mapped so incremental runs can remove and re-add chunks
+        index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+    elif index_type in ("sq8", "fp16"):
+        # scalar-quantized codes: 4x (sq8) or 2x (fp16) smaller than flat
+        qtype = (
+            faiss.ScalarQuantizer.QT_8bit
+            if index_type == "sq8"
+            else faiss.ScalarQuantizer.QT_fp16
+        )
+        index = faiss.IndexIDMap2(
+            faiss.IndexScalarQuantizer(dim, qtype, faiss.METRIC_INNER_PRODUCT)
+        )
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = hnsw_ef_construction
+    elif index_type == "ivf":
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+    elif index_type == "ivfpq":
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFPQ(
+            quantizer, dim, nlist, pq_m, pq_nbits, faiss.METRIC_INNER_PRODUCT
+        )
+    else:
+        raise ValueError(f"Unknown index type: {index_type}")
+
+    if not index.is_trained:
+        print(f"Training {index_type} index on {n} vectors...")
+        index.train(embeddings)  # type: ignore
+    if index_type == "hnsw":
+        index.add(embeddings)  # type: ignore
+    else:
+        # vector ids are positions in metadata
+        index.add_with_ids(embeddings, np.arange(n, dtype=np.int64))  # type: ignore
+    return index
+
+
+def ondisk_data_files(index_path: str) -> List[str]:
+    return glob.glob(f"{index_path}.*.ivfdata")
+
+
+def invlists_to_disk(index: faiss.Index, index_path: str) -> Optional[str]:
+    # Move an IVF index's lists into their own file next to the index. The
+    # server maps it read-only, so every worker shares one copy of the codes.
+    # Each build gets a fresh file; a running server keeps its old mapping.
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        print("--ondisk-ivf only applies to ivf and ivfpq indexes; ignoring it")
+        return None
+    data_path = f"{index_path}.{time.time_ns()}.ivfdata"
+    invlists = faiss.OnDiskInvertedLists(ivf.nlist, ivf.code_size, data_path)
+    src = faiss.InvertedListsPtrVector()
+    src.push_back(ivf.invlists)
+    invlists.merge_from_multiple(src.data(), src.size(), False, False)
+    invlists.this.disown()
+    ivf.replace_invlists(invlists, True)
+    return data_path
+
+
+def invlists_to_memory(index: faiss.Index):
+    # On-disk lists are opened read-only; copy them back before editing
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return
+    src = faiss.downcast_InvertedLists(ivf.invlists)
+    if not isinstance(src, faiss.OnDiskInvertedLists):
+        return
+    invlists = faiss.ArrayInvertedLists(ivf.nlist, ivf.code_size)
+    for i in range(ivf.nlist):
+        invlists.add_entries(i, src.list_size(i), src.get_ids(i), src.get_codes(i))
+    invlists.this.disown()
+    ivf.replace_invlists(invlists, True)
+
+
+def file_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def content_hashes(paths: List[str], records: Dict[str, Dict]) -> Dict[str, str]:
+    # a record hashes like a file holding its text, so switching between
+    # .txt files and --jsonl input does not re-embed anything
+    return {
+        path: (
+            hashlib.sha256(records[path]["text"].encode("utf-8")).hexdigest()
+            if path in records
+            else file_hash(path)
+        )
+        for path in paths
+    }
+
+
+def build_manifest(
+    records: List, sections: List, hashes: Dict[str, str]
+) -> Dict[str, Dict]:
+    manifest = {
+        path: {"hash": h, "ids": [], "parents": []} for path, h in hashes.items()
+    }
+    for key, items in (("ids", records), ("parents", sections)):
+        for i, item in enumerate(items):
+            if item is not None and item.get("path") in manifest:
+                manifest[item["path"]][key].append(i)
+    return manifest
+
+
+def incremental_ingest(
+    root_dir: str,
+    workers: int = PARSE_WORKERS,
+    records: Optional[Dict[str, Dict]] = None,
+) -> Tuple[faiss.Index, Dict[str, str]]:
+    """Re-embed only files whose content changed since the last run.
+
+    Chunks of changed or deleted files are removed from the index and their
+    metadata slots (and parent sections) become ``null`` tombstones, so
+    existing ids stay valid.
+    """
+    index = faiss.read_index(INDEX_PATH, faiss.IO_FLAG_ONDISK_SAME_DIR)
+    invlists_to_memory(index)
+    with open(METADATA_PATH, encoding="utf-8") as f:
+        metadata.extend(json.load(f))
+    if os.path.exists(PARENT_STORE_PATH):
+        store = ChunkStore(PARENT_STORE_PATH)
+        parents.extend(store)
+        store.close()
+    with open(MANIFEST_PATH, encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    records = records or {}
+    hashes = content_hashes(sorted(set(list_files(root_dir)) | set(records)), records)
+    stale = [p for p, entry in manifest.items() if hashes.get(p) != entry["hash"]]
+    changed = [p for p, h in hashes.items() if manifest.get(p, {}).get("hash") != h]
+
+    # indexes without an id map (hnsw) number vectors in insertion order, so
+    # new vectors only get the right ids while none were ever removed. Check
+    # before embedding anything, so a doomed run wastes no API calls.
+    sequential = not isinstance(
+        faiss.downcast_index(index),
+        (faiss.IndexIDMap, faiss.IndexIDMap2, faiss.IndexIVF),
+    )
+    if sequential and changed and index.ntotal != len(metadata):
+        raise SystemExit(
+            "This index type cannot add vectors after removed chunks; "
+            "run a full rebuild."
+        )
+
+    stale_ids = [i for p in stale for i in manifest[p]["ids"]]
+    if stale_ids:
+        try:
+            index.remove_ids(np.array(stale_ids, dtype=np.int64))
+        except RuntimeError as e:
+            raise SystemExit(
+                f"This index type cannot remove vectors ({e}); run a full rebuild."
+            )
+        for i in stale_ids:
+            metadata[i] = None
+    # indexes built before parent sections existed have none to remove
+    for i in [i for p in stale for i in manifest[p].get("parents", [])]:
+        parents[i] = None
+    print(
+        f"{len(changed)} new or changed files, {len(stale)} stale files "
+        f"({len(stale_ids)} chunks removed)"
+    )
+
+    start = len(metadata)
+    ingest_files(changed, workers, records)
+    if vectors and sequential:
+        index.add(np.vstack(vectors))  # type: ignore
+    elif vectors:
+        index.add_with_ids(  # type: ignore
+            np.vstack(vectors), np.arange(start, len(metadata), dtype=np.int64)
+        )
+
+    return index, hashes
+
+
+def write_full_vectors(path: str, n: int):
+    # Row i belongs to metadata[i]. An incremental run appends its new rows to
+    # the previous file; rows of removed chunks stay but are never searched.
+    new = np.vstack(vectors) if vectors else np.zeros((0, EMBED_DIM), np.float32)
+    old = np.zeros((0, EMBED_DIM), np.float32)
+    if n > len(new) and os.path.exists(path):
+        old = np.load(path, mmap_mode="r")
+    if len(old) + len(new) != n:
+        print(f"Cannot update {path} without a full rebuild; removing it")
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    with open(f"{path}.tmp", "wb") as f:
+        np.save(f, np.vstack([old, new]).astype(np.float32))
+    os.replace(f"{path}.tmp", path)
+    print(f"Wrote {n} full-precision vectors to {path}")
+
+
+def parse_args():
+    p = argparse.ArgumentParser(
+        description="Embed files under data/ and build the FAISS index + metadata."
+    )
+    p.add_argument(
+        "--index-type",
+        choices=["flat", "ivf", "hnsw", "ivfpq", "sq8", "fp16"],
+        default=INDEX_TYPE,
+        help=f"FAISS index type (default: {INDEX_TYPE})",
+    )
+    p.add_argument("--nlist", type=int, default=NLIST, help="IVF cells")
+    p.add_argument("--hnsw-m", type=int, default=HNSW_M, help="HNSW graph degree")
+    p.add_argument(
+        "--hnsw-ef-construction",
+        type=int,
+        default=HNSW_EF_CONSTRUCTION,
+        help="HNSW build-time search depth",
+    )
+    p.add_argument("--pq-m", type=int, default=PQ_M, help="PQ sub-quantizers")
+    p.add_argument("--pq-nbits", type=int, default=PQ_NBITS, help="Bits per PQ code")
+    p.add_argument(
+        "--workers",
+        type=int,
+        default=PARSE_WORKERS,
+        help=f"Processes used to parse and chunk files (default: {PARSE_WORKERS})",
+    )
+    p.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only embed new or changed files, updating the existing index in place",
+    )
+    p.add_argument(
+        "--full-vectors",
+        action="store_true",
+        help=f"Also save float32 vectors to {VECTORS_PATH} so the server can "
+        "re-score hits from a quantized index (kept up to date by --incremental)",
+    )
+    p.add_argument(
+        "--jsonl",
+        metavar="FILE",
+        help="Also ingest documents from a JSONL file ('-' for stdin), e.g. "
+        "the output of jsonpost2text.py --jsonl",
+    )
+    p.add_argument(
+        "--ondisk-ivf",
+        action="store_true",
+        help="Store ivf/ivfpq inverted lists in a separate file that server "
+        "workers memory-map and share (kept on disk by --incremental)",
+    )
+    return p.parse_args()
 
 
 if __name__ == "__main__":
+    args = parse_args()
     root = "data/"
-    ingest_dir(root)
     os.makedirs("model/", exist_ok=True)
+    records = load_records(args.jsonl) if args.jsonl else {}
 
-    # save index + metadata for later loading
-    faiss.write_index(index, "model/virtual-ta.faiss")
-    with open("model/metadata.json", "w", encoding="utf-8") as f:
-        json.dump(metadata, f, ensure_ascii=False, indent=4)
+    if args.incremental and os.path.exists(MANIFEST_PATH):
+        index, hashes = incremental_ingest(root, args.workers, records)
+        print(f"Updated index; it now holds {index.ntotal} vectors")
+    else:
+        if args.incremental:
+            print(f"No {MANIFEST_PATH} yet; doing a full build")
+        files = sorted(set(list_files(root)) | set(records))
+        hashes = content_hashes(files, records)
+        ingest_files(files, args.workers, records)
+        index = build_index(
+            np.vstack(vectors) if vectors else np.zeros((0, EMBED_DIM), np.float32),
+            index_type=args.index_type,
+            nlist=args.nlist,
+            hnsw_m=args.hnsw_m,
+            hnsw_ef_construction=args.hnsw_ef_construction,
+            pq_m=args.pq_m,
+            pq_nbits=args.pq_nbits,
+        )
+        print(f"Built {args.index_type} index with {index.ntotal} vectors")
 
-    print("Ingestion complete. FAISS index and metadata.json are on disk.")
+    # save index + metadata for later loading; the server reads chunks.bin
+    # lazily and only falls back to metadata.json when it is missing.
+    # The build marker is replaced last: servers wait for it to change, so
+    # they never pick up an index without its metadata.
+    write_chunk_store(PARENT_STORE_PATH, parents)
+    write_chunk_store(CHUNK_STORE_PATH, metadata)
+    print(f"Wrote BM25 index over {write_bm25_index(BM25_PATH, metadata)} chunks")
+    if args.full_vectors or (args.incremental and os.path.exists(VECTORS_PATH)):
+        write_full_vectors(VECTORS_PATH, len(metadata))
+    elif os.path.exists(VECTORS_PATH):
+        # left over from an earlier build; its rows belong to other chunks
+        os.remove(VECTORS_PATH)
+        print(f"Removed stale {VECTORS_PATH}")
+    with open(METADATA_PATH, "w", encoding="utf-8") as f:
+        json.dump(metadata, f, ensure_ascii=False)
+    with open(MANIFEST_PATH, "w", encoding="utf-8") as f:
+        json.dump(build_manifest(metadata, parents, hashes), f, indent=2)
+    old_data_files = ondisk_data_files(INDEX_PATH)
+    data_path = None
+    if args.ondisk_ivf or (args.incremental and old_data_files):
+        data_path = invlists_to_disk(index, INDEX_PATH)
+    faiss.write_index(index, f"{INDEX_PATH}.tmp")
+    os.replace(f"{INDEX_PATH}.tmp", INDEX_PATH)
+    # Servers still mapping an old lists file keep it until they reload
+    for path in old_data_files:
+        if path != data_path:
+            os.remove(path)
+    with open(f"{BUILD_MARKER_PATH}.tmp", "w", encoding="utf-8") as f:
+        # The server only loads files whose sizes match these counts
+        json.dump(
+            {
+                "built_at": time.time(),
+                "vectors": index.ntotal,
+                "chunks": len(metadata),
+                "parents": len(parents),
+            },
+            f,
+        )
+    os.replace(f"{BUILD_MARKER_PATH}.tmp", BUILD_MARKER_PATH)
+
+    print(
+        "Ingestion complete. FAISS index, chunks.bin, parents.bin, metadata.json, "
+        "bm25.npz, manifest.json and build.json are on disk."
+    )
@@ -1,13 +1,16 @@
 # Course Content Downloader
-# This script downloads a GitHub repository as a ZIP file.
+# This script downloads a GitHub repository as a ZIP file and extracts only its
+# course .md files, rewriting just the ones that changed since the last run.
 #
 # Content: https://github.com/sanand0/tools-in-data-science-public/tree/tds-2025-01
 
 import argparse
+import json
 import os
 import shutil
 import tempfile
 import zipfile
+import zlib
 from urllib.parse import urlparse
 import requests
 
@@ -33,37 +36,81 @@ def download_repo_zip(repo_url, ref, is_commit, dest_path):
     print(f"Saved ZIP to {dest_path}")
 
 
-def extract_zip(zip_path, extract_to):
-    """Extract ZIP file to the specified directory."""
-    print(f"Extracting {zip_path} to {extract_to}...")
-    with zipfile.ZipFile(zip_path, "r") as z:
-        z.extractall(extract_to)
-    print("Extraction complete.")
+def is_course_md(name):
+    """Whether an archive member is course content: .md, but not a readme or sidebar."""
+    fname = os.path.basename(name).lower()
+    return fname.endswith(".md") and fname != "readme.md" and "sidebar" not in fname
+
+
+def file_crc32(path):
+    crc = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
 
 
-def keep_only_md(root_dir):
-    """Remove all non-.md files and delete empty directories."""
-    for dirpath, dirnames, filenames in os.walk(root_dir, topdown=False):
-        # Remove non-md files
+def extract_md(zip_path, out_dir):
+    """
+    Extract only course .md members into out_dir, mirroring the archive.
+
+    Files whose size and CRC-32 match the archive member are left untouched,
+    and .md files no longer in the archive are deleted. Returns the relative
+    paths that were added, modified, removed and left unchanged.
+    """
+    print(f"Extracting .md files from {zip_path} to {out_dir}...")
+    changes = {"added": [], "modified": [], "removed": [], "unchanged": []}
+    seen = set()
+    with zipfile.ZipFile(zip_path, "r") as z:
+        for info in z.infolist():
+            if info.is_dir() or not is_course_md(info.filename):
+                continue
+            # GitHub archives wrap everything in a single repo-ref/ folder
+            parts = info.filename.split("/")[1:]
+            if not parts or any(part in ("", ".", "..") for part in parts):
+                continue
+            rel = os.path.join(*parts)
+            seen.add(rel)
+            dest = os.path.join(out_dir, rel)
+
+            if os.path.exists(dest):
+                if (
+                    os.path.getsize(dest) == info.file_size
+                    and file_crc32(dest) == info.CRC
+                ):
+                    changes["unchanged"].append(rel)
+                    continue
+                changes["modified"].append(rel)
+            else:
+                changes["added"].append(rel)
+
+            os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+            with z.open(info) as src, open(dest, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+
+    # Drop files that disappeared from the archive, then empty directories
+    for dirpath, dirnames, filenames in os.walk(out_dir, topdown=False):
         for fname in filenames:
-            if (
-                not fname.lower().endswith(".md")
-                or fname.lower() == "readme.md"
-                or "sidebar" in fname.lower()
-            ):
-                file_path = os.path.join(dirpath, fname)
-                os.remove(file_path)
-                # print(f"Removed file: {file_path}")
-
-        # Remove empty directories
-        if not os.listdir(dirpath):
+            path = os.path.join(dirpath, fname)
+            rel = os.path.relpath(path, out_dir)
+            if rel not in seen:
+                os.remove(path)
+                if is_course_md(fname):
+                    changes["removed"].append(rel)
+        if dirpath != out_dir and not os.listdir(dirpath):
             os.rmdir(dirpath)
-            # print(f"Removed empty directory: {dirpath}")
+
+    print(
+        f"Extraction complete: {len(changes['added'])} added, "
+        f"{len(changes['modified'])} modified, {len(changes['removed'])} removed, "
+        f"{len(changes['unchanged'])} unchanged."
+    )
+    return changes
 
 
 def parse_args():
     p = argparse.ArgumentParser(
-        description="Download a GitHub repo as ZIP (branch or specific commit), extract it, and keep only .md files."
+        description="Download a GitHub repo as ZIP (branch or specific commit) and extract only its .md files."
     )
     group = p.add_mutually_exclusive_group()
     group.add_argument("--branch", help="Branch name to download (default: main).")
@@ -74,6 +121,11 @@ def parse_args():
     p.add_argument(
         "--output", default=None, help="Output directory (default: <repo>-<ref>)"
     )
+    p.add_argument(
+        "--report",
+        default=None,
+        help="Write the added/modified/removed file lists to this JSON file",
+    )
     args = p.parse_args()
 
     # Set default branch if neither branch nor commit is provided
@@ -95,27 +147,22 @@ def main():
     with tempfile.TemporaryDirectory() as tmp:
         zip_path = os.path.join(tmp, f"{repo_name}.zip")
         download_repo_zip(args.repo_url, ref, is_commit, zip_path)
-        extract_zip(zip_path, tmp)
-
-        # Find extracted folder
-        # GitHub names branch archives as repo-ref and commit archives as repo-<short-sha>
-        extracted_folder = None
-        for item in os.listdir(tmp):
-            if os.path.isdir(os.path.join(tmp, item)):
-                extracted_folder = os.path.join(tmp, item)
-                break
-
-        if not extracted_folder:
-            raise FileNotFoundError("Could not locate extracted directory.")
-
-        # Move extracted contents to output directory
-        if os.path.exists(out_dir):
-            print(f"Removing existing directory {out_dir}...")
-            shutil.rmtree(out_dir)
-        shutil.move(extracted_folder, out_dir)
-        print(f"Moved contents to {out_dir}")
-
-    keep_only_md(out_dir)
+        os.makedirs(out_dir, exist_ok=True)
+        changes = extract_md(zip_path, out_dir)
+
+    for kind in ("added", "modified", "removed"):
+        for rel in changes[kind]:
+            print(f"{kind}: {os.path.join(out_dir, rel)}")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    kind: [os.path.join(out_dir, rel) for rel in changes[kind]]
+                    for kind in ("added", "modified", "removed")
+                },
+                f,
+                indent=2,
+            )
     print("Done. Only .md files remain.")
 
 
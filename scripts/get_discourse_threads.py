@@ -13,13 +13,28 @@ Usage:
       --end-date      "2025-05-10" \
       --output-dir    "data/raw_discourse_threads" \
       [--api-key KEY --api-username USER] \
-      [--cookies "name=value; name2=value2"]
+      [--cookies "name=value; name2=value2"] \
+      [--async --concurrency 8 --rate 4] \
+      [--sync [--state-file PATH]]
+
+--async fetches topics and their pages concurrently over one pooled
+connection; --rate caps requests per second across all of them.  Both modes
+retry 429/5xx responses with jittered backoff and honour Retry-After.
+
+--sync keeps bumped_at/last_posted_at per topic in a state file, re-fetches
+only topics that changed since the last run (and only their new post pages),
+and stops paging once the category listing reaches topics older than the
+previous sync.
 """
 
 import os
 import json
+import time
+import random
+import asyncio
 import argparse
 import requests
+import httpx
 from math import ceil
 from datetime import datetime, timezone
 from dateutil import parser as dateparser
@@ -65,6 +80,44 @@ def parse_args():
         help="Raw Cookie header to authenticate (e.g. 'name=val; name2=val2')",
     )
 
+    fetch = p.add_argument_group("fetching")
+    fetch.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="Fetch topics concurrently over a shared connection pool",
+    )
+    fetch.add_argument(
+        "--concurrency",
+        type=int,
+        default=8,
+        help="Topics fetched at once in --async mode (default: 8)",
+    )
+    fetch.add_argument(
+        "--rate",
+        type=float,
+        default=4.0,
+        help="Max requests per second in --async mode (default: 4)",
+    )
+    fetch.add_argument(
+        "--max-retries",
+        type=int,
+        default=5,
+        help="Retries for 429/5xx and connection errors (default: 5)",
+    )
+
+    sync = p.add_argument_group("incremental sync")
+    sync.add_argument(
+        "--sync",
+        action="store_true",
+        help="Refresh changed threads only, using the state file",
+    )
+    sync.add_argument(
+        "--state-file",
+        default=None,
+        help="Sync state file (default: <output-dir>/.sync_state.json)",
+    )
+
     return p.parse_args()
 
 
@@ -73,10 +126,347 @@ def ensure_dir(path):
         os.makedirs(path, exist_ok=True)
 
 
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 5
+
+# One keep-alive session for every request in sequential mode
+session = requests.Session()
+
+
+def retry_delay(attempt, retry_after=None):
+    """Seconds to wait before retry ``attempt``: Retry-After if given, else jittered backoff."""
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            try:
+                when = dateparser.parse(retry_after)
+                return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+            except (ValueError, OverflowError):
+                pass
+    return min(60.0, 2**attempt) * random.uniform(0.5, 1.0)
+
+
 def fetch_json(url, params=None, headers=None):
-    resp = requests.get(url, params=params, headers=headers)
-    resp.raise_for_status()
-    return resp.json()
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            resp = session.get(url, params=params, headers=headers)
+        except requests.ConnectionError:
+            if attempt == MAX_RETRIES:
+                raise
+            time.sleep(retry_delay(attempt))
+            continue
+        if resp.status_code in RETRY_STATUSES and attempt < MAX_RETRIES:
+            delay = retry_delay(attempt, resp.headers.get("Retry-After"))
+            print(f"  [retry] {resp.status_code} for {url}; waiting {delay:.1f}s")
+            time.sleep(delay)
+            continue
+        resp.raise_for_status()
+        return resp.json()
+
+
+def save_thread(out_f, first, posts):
+    combined = first
+    combined["post_stream"]["posts"] = posts
+    with open(out_f, "w", encoding="utf-8") as fd:
+        json.dump(combined, fd, ensure_ascii=False)
+
+
+def topic_page_count(first):
+    posts = first.get("post_stream", {}).get("posts", [])
+    total_posts = first.get("posts_count") or len(
+        first.get("post_stream", {}).get("stream", [])
+    )
+    per_page = len(posts)
+    if per_page and total_posts > per_page:
+        return ceil(total_posts / per_page)
+    return 1
+
+
+def load_sync_state(path):
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as fd:
+            return json.load(fd)
+    return {"watermark": None, "topics": {}}
+
+
+def save_sync_state(path, state):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fd:
+        json.dump(state, fd, indent=2)
+    os.replace(tmp, path)
+
+
+def sync_entry(state, tid, out_f):
+    if not os.path.exists(out_f):
+        # the thread file was deleted; fetch the whole topic again
+        state["topics"].pop(str(tid), None)
+        return None
+    entry = state["topics"].get(str(tid))
+    if entry is None:
+        # seed from a thread saved before sync mode was used
+        with open(out_f, encoding="utf-8") as fd:
+            data = json.load(fd)
+        entry = {
+            "bumped_at": data.get("bumped_at"),
+            "last_posted_at": data.get("last_posted_at"),
+            "posts_count": data.get("posts_count", 0),
+        }
+    return entry
+
+
+def topic_unchanged(topic, entry):
+    return (
+        entry is not None
+        and entry.get("bumped_at") == topic.get("bumped_at")
+        and entry.get("last_posted_at") == topic.get("last_posted_at")
+    )
+
+
+def below_watermark(topic, watermark):
+    # The listing is ordered by bumped_at, except for pinned topics at the top
+    bumped = topic.get("bumped_at")
+    if not watermark or not bumped or topic.get("pinned"):
+        return False
+    return dateparser.isoparse(bumped) <= dateparser.isoparse(watermark)
+
+
+def resume_page(entry, first):
+    """First topic page that can hold posts newer than the last sync."""
+    per_page = len(first.get("post_stream", {}).get("posts", []))
+    if not entry or not per_page:
+        return 2
+    # start one page early in case posts were deleted in between
+    return max(2, entry.get("posts_count", 0) // per_page)
+
+
+def merge_posts(old_posts, new_posts):
+    by_id = {p["id"]: p for p in old_posts}
+    by_id.update({p["id"]: p for p in new_posts})
+    return sorted(by_id.values(), key=lambda p: p.get("post_number", 0))
+
+
+def in_window(topic, start_dt, end_dt):
+    created = topic.get("created_at")
+    return bool(created) and start_dt <= dateparser.isoparse(created) <= end_dt
+
+
+def plan_topic(topic, output_dir, start_dt, end_dt, state):
+    """Return ``(out_f, sync entry)`` if the topic should be fetched, else None."""
+    if not in_window(topic, start_dt, end_dt):
+        return None
+
+    tid = topic["id"]
+    out_f = os.path.join(output_dir, f"thread_{tid}.json")
+    if state is None:
+        if os.path.exists(out_f):
+            print(f"  [skip] {tid} already exists")
+            return None
+        return out_f, None
+
+    entry = sync_entry(state, tid, out_f)
+    if topic_unchanged(topic, entry):
+        print(f"  [skip] {tid} unchanged since last sync")
+        return None
+    return out_f, entry
+
+
+def finish_topic(out_f, first, posts, entry, state):
+    if entry is not None and os.path.exists(out_f):
+        with open(out_f, encoding="utf-8") as fd:
+            old = json.load(fd)
+        posts = merge_posts(old.get("post_stream", {}).get("posts", []), posts)
+    save_thread(out_f, first, posts)
+    if state is not None:
+        state["topics"][str(first["id"])] = {
+            "bumped_at": first.get("bumped_at"),
+            "last_posted_at": first.get("last_posted_at"),
+            "posts_count": first.get("posts_count", len(posts)),
+        }
+    return posts
+
+
+def newest_bump(topics, current, start_dt, end_dt):
+    # only topics this run actually syncs may move the watermark
+    bumps = [
+        t["bumped_at"]
+        for t in topics
+        if t.get("bumped_at") and in_window(t, start_dt, end_dt)
+    ]
+    if current:
+        bumps.append(current)
+    return max(bumps, key=dateparser.isoparse) if bumps else None
+
+
+class TokenBucket:
+    """Allow ``rate`` requests per second on average, bursting up to ``burst``.
+
+    ``pause`` blocks every caller, which is how a Retry-After from the server
+    throttles all in-flight workers rather than just the one that got a 429.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AsyncFetcher:
+    def __init__(self, client, bucket, max_retries=MAX_RETRIES):
+        self.client = client
+        self.bucket = bucket
+        self.max_retries = max_retries
+
+    async def get_json(self, url, params=None):
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            try:
+                resp = await self.client.get(url, params=params)
+            except httpx.TransportError:
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(retry_delay(attempt))
+                continue
+            if resp.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                retry_after = resp.headers.get("Retry-After")
+                delay = retry_delay(attempt, retry_after)
+                if retry_after:
+                    self.bucket.pause(delay)
+                print(f"  [retry] {resp.status_code} for {url}; waiting {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            resp.raise_for_status()
+            return resp.json()
+
+
+async def fetch_topic_async(fetcher, base_url, tid, entry=None):
+    params = {"track_visit": False, "forceLoad": True}
+    first = await fetcher.get_json(f"{base_url}/t/{tid}.json", {**params, "page": 1})
+    posts = first.get("post_stream", {}).get("posts", [])
+    pages = topic_page_count(first)
+    start = resume_page(entry, first)
+    if pages >= start:
+        more = await asyncio.gather(
+            *(
+                fetcher.get_json(f"{base_url}/t/{tid}.json", {**params, "page": p})
+                for p in range(start, pages + 1)
+            )
+        )
+        for page in more:
+            more_posts = page.get("post_stream", {}).get("posts", [])
+            if not more_posts:
+                break
+            posts.extend(more_posts)
+    return first, posts
+
+
+async def download_async(args, headers, start_dt, end_dt, state=None):
+    limits = httpx.Limits(
+        max_connections=args.concurrency, max_keepalive_connections=args.concurrency
+    )
+    async with httpx.AsyncClient(
+        headers=headers, limits=limits, timeout=30.0
+    ) as client:
+        fetcher = AsyncFetcher(client, TokenBucket(args.rate), args.max_retries)
+        semaphore = asyncio.Semaphore(args.concurrency)
+        downloaded = 0
+
+        async def download_topic(topic, out_f, entry):
+            nonlocal downloaded
+            tid = topic["id"]
+            async with semaphore:
+                first, posts = await fetch_topic_async(
+                    fetcher, args.base_url, tid, entry
+                )
+            posts = finish_topic(out_f, first, posts, entry, state)
+            created_dt = dateparser.isoparse(topic["created_at"])
+            print(
+                f"  [save]  {tid} - {topic.get('title', '')} ({created_dt.date()}) [posts: {len(posts)}]"
+            )
+            downloaded += 1
+
+        tasks = []
+        page = 0
+        watermark = state["watermark"] if state else None
+        newest = watermark
+        while True:
+            resp = await fetcher.get_json(
+                f"{args.base_url}/c/{args.category_path}.json",
+                params={"page": page, "per_page": 100},
+            )
+            topics = resp.get("topic_list", {}).get("topics", [])
+            if not topics:
+                print("→ No more topics returned; done.")
+                break
+            newest = newest_bump(topics, newest, start_dt, end_dt)
+
+            reached_watermark = False
+            for topic in topics:
+                if below_watermark(topic, watermark):
+                    reached_watermark = True
+                    break
+                plan = plan_topic(topic, args.output_dir, start_dt, end_dt, state)
+                if plan is None:
+                    continue
+                # topics download in the background while listing continues
+                tasks.append(asyncio.create_task(download_topic(topic, *plan)))
+            if reached_watermark:
+                print("→ Reached topics older than the last sync; done.")
+                break
+            page += 1
+
+        await asyncio.gather(*tasks)
+        if state is not None:
+            state["watermark"] = newest
+        return downloaded
+
+
+def fetch_topic(base_url, tid, headers, entry=None):
+    first = fetch_json(
+        f"{base_url}/t/{tid}.json",
+        params={"track_visit": False, "forceLoad": True, "page": 1},
+        headers=headers,
+    )
+
+    posts = first.get("post_stream", {}).get("posts", [])
+    pages = topic_page_count(first)
+    for pnum in range(resume_page(entry, first), pages + 1):
+        more = fetch_json(
+            f"{base_url}/t/{tid}.json",
+            params={
+                "track_visit": False,
+                "forceLoad": True,
+                "page": pnum,
+            },
+            headers=headers,
+        )
+        more_posts = more.get("post_stream", {}).get("posts", [])
+        if not more_posts:
+            break
+        posts.extend(more_posts)
+    return first, posts
 
 
 def main():
@@ -110,13 +500,38 @@ def main():
     else:
         headers["Cookie"] = args.cookies
 
-    page = 0
-    downloaded = 0
-
     print(
         f"→ Scanning /c/{args.category_path}.json pages for threads from {start_dt.date()} to {end_dt.date()}…"
     )
 
+    global MAX_RETRIES
+    MAX_RETRIES = args.max_retries
+
+    state_file = args.state_file or os.path.join(args.output_dir, ".sync_state.json")
+    state = load_sync_state(state_file) if args.sync else None
+
+    try:
+        if args.use_async:
+            downloaded = asyncio.run(
+                download_async(args, headers, start_dt, end_dt, state)
+            )
+        else:
+            downloaded = download(args, headers, start_dt, end_dt, state)
+    finally:
+        # Per-topic entries are kept even if the run fails; the watermark only
+        # moves forward once a run has completed
+        if state is not None:
+            save_sync_state(state_file, state)
+
+    print(f"✔ Completed: {downloaded} threads saved to “{args.output_dir}”.")
+
+
+def download(args, headers, start_dt, end_dt, state=None):
+    page = 0
+    downloaded = 0
+    watermark = state["watermark"] if state else None
+    newest = watermark
+
     while True:
         resp = fetch_json(
             f"{args.base_url}/c/{args.category_path}.json",
@@ -128,71 +543,40 @@ def main():
         if not topics:
             print("→ No more topics returned; done.")
             break
+        newest = newest_bump(topics, newest, start_dt, end_dt)
 
+        reached_watermark = False
         for topic in topics:
-            created = topic.get("created_at")
-            if not created:
-                continue
+            if below_watermark(topic, watermark):
+                reached_watermark = True
+                break
 
-            created_dt = dateparser.isoparse(created)
-            # skip anything before our start date
-            if created_dt < start_dt:
+            plan = plan_topic(topic, args.output_dir, start_dt, end_dt, state)
+            if plan is None:
                 continue
+            out_f, entry = plan
 
-            # within window?
-            if start_dt <= created_dt <= end_dt:
-                tid = topic["id"]
-                title = topic.get("title", "")
-                out_f = os.path.join(args.output_dir, f"thread_{tid}.json")
-
-                if os.path.exists(out_f):
-                    print(f"  [skip] {tid} already exists")
-                    continue
+            tid = topic["id"]
+            title = topic.get("title", "")
+            created_dt = dateparser.isoparse(topic["created_at"])
+            first, posts = fetch_topic(args.base_url, tid, headers, entry)
 
-                first = fetch_json(
-                    f"{args.base_url}/t/{tid}.json",
-                    params={"track_visit": False, "forceLoad": True, "page": 1},
-                    headers=headers,
-                )
+            # Save combined data
+            posts = finish_topic(out_f, first, posts, entry, state)
 
-                posts = first.get("post_stream", {}).get("posts", [])
-                total_posts = first.get("posts_count") or len(
-                    first.get("post_stream", {}).get("stream", [])
-                )
-                per_page = len(posts)
-
-                if per_page and total_posts > per_page:
-                    pages = ceil(total_posts / per_page)
-                    for pnum in range(2, pages + 1):
-                        more = fetch_json(
-                            f"{args.base_url}/t/{tid}.json",
-                            params={
-                                "track_visit": False,
-                                "forceLoad": True,
-                                "page": pnum,
-                            },
-                            headers=headers,
-                        )
-                        more_posts = more.get("post_stream", {}).get("posts", [])
-                        if not more_posts:
-                            break
-                        posts.extend(more_posts)
-
-                # Save combined data
-                combined = first
-                combined["post_stream"]["posts"] = posts
-
-                with open(out_f, "w", encoding="utf-8") as fd:
-                    json.dump(combined, fd, ensure_ascii=False)
-
-                print(
-                    f"  [save]  {tid} - {title} ({created_dt.date()}) [posts: {len(posts)}]"
-                )
-                downloaded += 1
+            print(
+                f"  [save]  {tid} - {title} ({created_dt.date()}) [posts: {len(posts)}]"
+            )
+            downloaded += 1
 
+        if reached_watermark:
+            print("→ Reached topics older than the last sync; done.")
+            break
         page += 1
 
-    print(f"✔ Completed: {downloaded} threads saved to “{args.output_dir}”.")
+    if state is not None:
+        state["watermark"] = newest
+    return downloaded
 
 
 if __name__ == "__main__":
@@ -3,23 +3,33 @@
 Convert Discourse thread JSON files to plain-text Markdown summaries.
 Supports processing a single file or all JSON files in a directory.
 Usage:
-    jsonpost2text.py input_path [--output OUTPUT_DIR]
+    jsonpost2text.py input_path [--output OUTPUT_DIR] [--workers N] [--force] [--jsonl]
 
 Examples:
     jsonpost2text.py thread.json
     jsonpost2text.py /path/to/json_dir --output ./out_texts
+    jsonpost2text.py /path/to/json_dir --jsonl > threads.jsonl
+
+Directories are converted on a process pool; threads whose text file is newer
+than their JSON are skipped unless --force is given.  --jsonl writes one
+record per thread ({"path", "source", "text"}) to stdout instead of .txt
+files, ready for `create_vector_db.py --jsonl`.
 """
+
+import os
 import sys
 import json
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import argparse
+from typing import Optional, Set, Tuple
 from bs4 import BeautifulSoup
 
+DISCOURSE_URL = "https://discourse.onlinedegree.iitm.ac.in"
 
-def html_to_text(html: str) -> str:
-    """Strip HTML tags and collapse whitespace to plain text."""
-    soup = BeautifulSoup(html, "html.parser")
-    text = soup.get_text(separator="\n")
+
+def clean_text(text: str) -> str:
+    """Strip trailing spaces and collapse runs of blank lines."""
     lines = [line.rstrip() for line in text.splitlines()]
     cleaned = []
     prev_blank = False
@@ -34,57 +44,107 @@ def html_to_text(html: str) -> str:
     return "\n".join(cleaned).strip()
 
 
-po = set()
+def html_to_text(html: str) -> str:
+    """Strip HTML tags and collapse whitespace to plain text."""
+    soup = BeautifulSoup(html, "html.parser")
+    return clean_text(soup.get_text(separator="\n"))
+
 
+def posts_to_text(htmls: list) -> list:
+    """Convert several posts' HTML with a single parse instead of one per post."""
+    wrapped = "".join(f"<article>{html}</article>" for html in htmls)
+    soup = BeautifulSoup(wrapped, "html.parser")
+    articles = soup.find_all("article", recursive=False)
+    if len(articles) != len(htmls):
+        # Some post's markup swallowed the wrapper; fall back to per-post parsing
+        return [html_to_text(html) for html in htmls]
+    return [clean_text(a.get_text(separator="\n")) for a in articles]
 
-def thread_to_text(data: dict) -> str:
+
+def thread_to_text(data: dict, user_titles: Optional[Set] = None) -> str:
     """Convert JSON thread data to a formatted text block."""
     posts = data.get("post_stream", {}).get("posts", [])
     posts.sort(key=lambda p: p.get("created_at", ""))
+    bodies = posts_to_text([post.get("cooked", "") for post in posts])
     out_lines = []
-    for post in posts:
+    for post, body in zip(posts, bodies):
         ts = post.get("created_at", "")
         name = post.get("name") or post.get("username")
         user = post.get("username", "")
         user_post = post.get("user_title", None)
-        if user_post not in po:
-            po.add(user_post)
+        if user_titles is not None:
+            user_titles.add(user_post)
 
         header = f"[{ts}] {name} (@{user}{(': ' + user_post) if user_post else ''})"
-        body = html_to_text(post.get("cooked", ""))
         out_lines.append(header)
         out_lines.append(body)
         out_lines.append("")
     return "\n".join(out_lines).strip()
 
 
-def process_file(input_file: Path, output_dir: Path) -> None:
-    """Read a JSON file and write the corresponding text file."""
+def render_thread(data: dict, fallback_id: str, user_titles: Set) -> Tuple[str, str]:
+    """Return the thread id and the full text written for it."""
+    post_id = data.get("id", fallback_id)
+    title = data.get("title", "")
+    created_at = data.get("created_at", "")
+    text_content = thread_to_text(data, user_titles)
+    text = (
+        "---\n"
+        f"id:          {post_id}\n"
+        f"title:       {title}\n"
+        f"created_at:  {created_at}\n"
+        "---\n\n"
+        f"{text_content}"
+    )
+    return str(post_id), text
+
+
+def process_file(
+    input_file: Path, output_dir: Path, force: bool = False, jsonl: bool = False
+) -> Tuple[Optional[dict], Set]:
+    """Convert one JSON file.
+
+    Writes ``thread_<id>.txt`` (skipped when it is newer than the input, unless
+    ``force``), or with ``jsonl`` returns a record instead of writing a file.
+    Also returns the user titles seen in the thread.
+    """
+    log = sys.stderr if jsonl else sys.stdout
+    user_titles: Set = set()
+
+    if not jsonl and not force:
+        # scraped files are thread_<id>.json, so the output shares their stem
+        out_path = output_dir / f"{input_file.stem}.txt"
+        if out_path.exists() and out_path.stat().st_mtime >= input_file.stat().st_mtime:
+            print(f"Unchanged {input_file}", file=log)
+            return None, user_titles
+
     try:
         with input_file.open(encoding="utf-8") as f:
             data = json.load(f)
     except Exception as e:
         print(f"Error reading {input_file}: {e}", file=sys.stderr)
-        return
+        return None, user_titles
 
-    post_id = data.get("id", input_file.stem)
-    title = data.get("title", "")
-    created_at = data.get("created_at", "")
-    text_content = thread_to_text(data)
+    post_id, text = render_thread(data, input_file.stem, user_titles)
+    out_path = output_dir / f"thread_{post_id}.txt"
+
+    if jsonl:
+        record = {
+            "path": str(out_path),
+            "source": f"{DISCOURSE_URL}/t/{data.get('slug', '')}/{post_id}",
+            "text": text,
+        }
+        print(f"Processed {input_file}", file=log)
+        return record, user_titles
 
     output_dir.mkdir(parents=True, exist_ok=True)
-    out_path = output_dir / f"thread_{post_id}.txt"
     try:
         with out_path.open("w", encoding="utf-8") as txt:
-            txt.write("---\n")
-            txt.write(f"id:          {post_id}\n")
-            txt.write(f"title:       {title}\n")
-            txt.write(f"created_at:  {created_at}\n")
-            txt.write("---\n\n")
-            txt.write(text_content)
-        print(f"Processed {input_file} -> {out_path}")
+            txt.write(text)
+        print(f"Processed {input_file} -> {out_path}", file=log)
     except Exception as e:
         print(f"Error writing {out_path}: {e}", file=sys.stderr)
+    return None, user_titles
 
 
 def main():
@@ -103,6 +163,23 @@ def main():
         default=Path("./discourse_posts"),
         help="Output directory for text files.",
     )
+    parser.add_argument(
+        "--workers",
+        "-j",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Processes used to convert a directory (default: one per core).",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Rewrite text files even if they are newer than their JSON.",
+    )
+    parser.add_argument(
+        "--jsonl",
+        action="store_true",
+        help="Write one JSON record per thread to stdout instead of .txt files.",
+    )
     args = parser.parse_args()
 
     if not args.input_path.exists():
@@ -110,7 +187,7 @@ def main():
         sys.exit(1)
 
     if args.input_path.is_file():
-        process_file(args.input_path, args.output)
+        json_files = [args.input_path]
     else:
         # Directory: process all .json files
         json_files = sorted(args.input_path.glob("*.json"))
@@ -118,10 +195,24 @@ def main():
             print(f"No JSON files found in {args.input_path}.", file=sys.stderr)
             sys.exit(1)
 
-        for jf in json_files:
-            process_file(jf, args.output)
+    user_titles: Set = set()
+    n = len(json_files)
+    with ProcessPoolExecutor(max_workers=max(1, min(args.workers, n))) as pool:
+        results = pool.map(
+            process_file,
+            json_files,
+            [args.output] * n,
+            [args.force] * n,
+            [args.jsonl] * n,
+            chunksize=max(1, n // (args.workers * 4)),
+        )
+        for record, titles in results:
+            user_titles |= titles
+            if record is not None:
+                sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    print(user_titles, file=sys.stderr if args.jsonl else sys.stdout)
 
 
 if __name__ == "__main__":
     main()
-    print(po)